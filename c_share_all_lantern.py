@@ -1,31 +1,59 @@
-import pandas as pd
 import altair as alt
 import webbrowser
+import glob
+import os
+import sys
 import re  # Import regular expression library
+import functools  # functools for caching the compiled template
+# the shared helper modules are in final_assignment (they import each other by module name)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'final_assignment'))
+from data_cache import load_plot_data, layer_data  # cached excel loader, per layer data
+from curve_simplify import simplify_line  # optional curve downsampling
+from build_manifest import build_hash, is_current, record_build  # incremental builds
+from static_export import STATIC_FORMATS, save_chart, warm_up  # svg/png/pdf export
+from stage_trace import panel, stage, start_trace, stop_trace  # optional stage timings
+from chart_templates import bind_template, compile_template  # chart compiled once, data swapped per workbook
+import data_cache, plot_files, curve_simplify, chart_templates, static_export  # modules hashed for --incremental
 
-def generate_chart(file_path):
+# everything that changes the charts, hashed for the incremental builds (build_manifest.py)
+CHART_MODULES = (sys.modules[__name__], data_cache, plot_files, curve_simplify, chart_templates, static_export)
+
+# placeholder names of the layer data in the template (same order as lantern_layers)
+LANTERN_LAYERS = ('catch_share_curve', 'catch_points', 'control_population', 'test_population')
+
+def lantern_layers(file_path, simplify=False):
+    # title and layer data of one workbook, as (title, [curve, points, control, test])
     match = re.search(r'c_share_lantern_(MB\d+)_', file_path)
     title_suffix = match.group(1) if match else 'Unknown'
-    data = pd.read_excel(file_path, header=1)
-    data = data.apply(pd.to_numeric, errors='coerce')
+    data = load_plot_data(file_path)
+
+    # catch share rate curve, downsampled to the visible points if simplify is True
+    catch_share_curve = layer_data(data, ['X1', 'Y1'])
+    if simplify:
+        catch_share_curve = simplify_line(catch_share_curve, 'X1', 'Y1', [15, 85], [0, 1], width=400, height=250)
+    return title_suffix, [catch_share_curve, layer_data(data, ['X0', 'Y0']), layer_data(data, ['X2', 'Y2']),
+                          layer_data(data, ['X2', 'Y3'])]
+
+def build_chart(catch_share_curve, catch_points, control_population, test_population, title_suffix):
+    # the chart from its layer data (data frames, or alt.NamedData for the template)
 
     # combine line (catch share rate) and circle (catch share points) for left axis
-    left_axis_chart = alt.Chart(data).mark_line(color='black', clip=True).encode(
+    left_axis_chart = alt.Chart(catch_share_curve).mark_line(color='black', clip=True).encode(
         x=alt.X('X1:Q', scale=alt.Scale(domain=[15, 85]), title='Length (mm)',
             axis=alt.Axis(values=[15, 25, 35, 45, 55, 65, 75, 85], grid=False, titleFontSize=20, labelFontSize=15)),
         y=alt.Y('Y1:Q', scale=alt.Scale(domain=[0, 1]), title='Catch share rate',
             axis=alt.Axis(values=[0, 0.25, 0.50, 0.75, 1.00], labelFontSize=15, titleFontSize=20, format='.2f', grid=False))
-    ) + alt.Chart(data).mark_point(shape='circle', clip=True, filled=False, size=50, color='black').encode(
+    ) + alt.Chart(catch_points).mark_point(shape='circle', clip=True, filled=False, size=50, color='black').encode(
         x=alt.X('X0:Q', scale=alt.Scale(domain=[15, 85])),
         y='Y0:Q'
     )
 
     # combine dotted population struct (pop+test) with right y axis
-    right_axis_chart = alt.Chart(data).mark_line(strokeDash=[5, 5], color='black', clip=True).encode(
+    right_axis_chart = alt.Chart(control_population).mark_line(strokeDash=[5, 5], color='black', clip=True).encode(
         x='X2:Q',
         y=alt.Y('Y2:Q', scale=alt.Scale(domain=[0, 400]), title='Number captured',
             axis=alt.Axis(orient='right', labelFontSize=15, titleFontSize=20, grid=False, values=[0, 100, 200, 300, 400]))
-    ) + alt.Chart(data).mark_line(strokeDash=[5, 5], color='darkgrey', clip=True).encode(
+    ) + alt.Chart(test_population).mark_line(strokeDash=[5, 5], color='darkgrey', clip=True).encode(
         x='X2:Q',
         y=alt.Y('Y3:Q', scale=alt.Scale(domain=[0, 400]))
     )
@@ -36,23 +64,59 @@ def generate_chart(file_path):
     )
 
     # combine all charts
-    final_chart = alt.layer(left_axis_chart, right_axis_chart).resolve_scale(
+    return alt.layer(left_axis_chart, right_axis_chart).resolve_scale(
         y='independent'
     ).properties(
         width=400, height=250, title= title_suffix
     ).configure_title(fontSize=30)
+
+# the chart built and validated once, every workbook only puts its data and title in (see chart_templates.py)
+@functools.lru_cache(maxsize=None)
+def chart_template():
+    return compile_template(build_chart(*[alt.NamedData(name=name) for name in LANTERN_LAYERS], '{title}'))
+
+def generate_chart(file_path, simplify=False, chart_file=None, open_browser=True, incremental=False):
+    # html next to the workbook unless another output file is given,
+    # chart_file can also end with .svg, .png or .pdf for static export
+    if chart_file is None:
+        chart_file = f"{os.path.splitext(file_path)[0]}.html"
+    # with incremental=True the chart is not rebuilt when the workbook and chart code did not change
+    chart_hash = build_hash([file_path], CHART_MODULES, {'simplify': simplify})
+    if incremental and is_current(chart_file, chart_hash):
+        return chart_file
+
+    with panel(file_path):  # timing of the chart, only when tracing is on (see stage_trace.py)
+        title_suffix, layers = lantern_layers(file_path, simplify)
+        with stage('template_bind', file_path):
+            datasets = {}
+            final_chart = bind_template(chart_template(), dict(zip(LANTERN_LAYERS, layers)),
+                                        {'{title}': title_suffix}, datasets)
+            final_chart['datasets'] = datasets
     
-    chart_file = f"{file_path.split('.')[0]}.html"
-    final_chart.save(chart_file)
-    webbrowser.open(chart_file)
-
-# List of file paths
-file_paths = [
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_lantern_MB14_21.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_lantern_MB20_21.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_lantern_MB30_21.xlsx',
-]
-
-# Generate charts for each file path
-for path in file_paths:
-    generate_chart(path)
+        save_chart(final_chart, chart_file)
+    record_build(chart_file, chart_hash)
+    if open_browser and chart_file.endswith('.html'):  # headless runs pass open_browser=False
+        webbrowser.open(chart_file)
+    return chart_file
+
+if __name__ == '__main__':
+    # workbooks are read from the folder given on the command line (default: current folder),
+    # add --no-browser to only save the html files, --incremental to skip unchanged charts,
+    # --svg, --png or --pdf to save the charts in that format instead of html,
+    # --trace to write the stage timings to lantern_trace.json in the data folder
+    options = ['--no-browser', '--incremental', '--trace'] + [f'--{output_format}' for output_format in STATIC_FORMATS]
+    args = [arg for arg in sys.argv[1:] if arg not in options]
+    output_format = next((output_format for output_format in STATIC_FORMATS if f'--{output_format}' in sys.argv), 'html')
+    if output_format != 'html':
+        warm_up()  # one renderer for all charts
+    data_dir = args[0] if args else '.'
+    file_paths = sorted(glob.glob(os.path.join(data_dir, 'c_share_lantern_MB*_*.xlsx')))
+    if '--trace' in sys.argv:
+        start_trace()
+
+    # Generate charts for each file path
+    for path in file_paths:
+        generate_chart(path, chart_file=f'{os.path.splitext(path)[0]}.{output_format}',
+                       open_browser='--no-browser' not in sys.argv, incremental='--incremental' in sys.argv)
+    if '--trace' in sys.argv:
+        stop_trace(os.path.join(data_dir, 'lantern_trace.json'))
@@ -1,6 +1,10 @@
 import pandas as pd
 import altair as alt
 
+# one chart of one workbook, built once: kept as the original one-off script (not on the chart
+# templates of final_assignment/chart_templates.py, a template only pays off when it is bound many
+# times). For all lantern workbooks use c_share_all_lantern.py, which binds its compiled template per file.
+
 # Load data
 file_path = r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\C_Share_lantern_14_ext_21.xlsx'
 data = pd.read_excel(file_path, header=1)
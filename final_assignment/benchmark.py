@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the load -> transform -> spec -> save pipeline on synthetic workbooks.
+
+Synthetic c_share_*/sel_cur_* workbooks with the X0..Y3 layout of the statistical software
+export (first row "S = 0" labels, second row X0, Y0, ... headers, ragged columns padded with
+empty cells) are written to a temporary folder for every size in the grid of rows x meshes x
+species. Then each stage is timed separately:
+
+    per panel (generate_chart1 / generate_chart2):
+        read_excel, to_numeric (the old pandas loading, for comparison),
+        read_typed (data_cache.read_plot_excel), layers (layer data + simplify), spec_build, to_dict, save_html
+    per figure (generate_combined_chart and the other modes):
+        combined_cold (empty cache, excel is parsed), combined_to_dict, combined_save_html,
+        combined_warm (cache filled), combined_parallel, combined_template (generate_combined_spec),
+        combined_template_parallel, combined_template_save_html, combined_faceted (tidy_store.py, first species only)
+
+All stages run without curve simplification by default, like exam_script_fig8.py, so the
+full payload is measured. --simplify measures the downsampled figures instead, every record
+has a "simplify" field so both runs can be compared.
+
+Every stage reports the best time of --repeat runs and the peak memory (tracemalloc,
+in a separate run so it does not slow down the timing). The results are written as
+JSON lines, one record per stage and size, so runs can be compared for regressions.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --rows 100 1000 10000 --meshes 3 6 --species 1 2 -o bench.jsonl
+    python benchmark.py --simplify
+"""
+
+import argparse   # argparse for the command line options
+import json       # json for the machine readable output
+import os         # os for paths
+import shutil     # shutil for emptying the cache between the cold runs
+import sys        # sys for the output stream
+import tempfile   # tempfile for the synthetic workbooks
+import time       # time for the stage timings
+import tracemalloc  # tracemalloc for the peak memory of each stage
+
+import numpy as np   # numpy for the synthetic curves
+import pandas as pd  # pandas for writing the workbooks and the stages
+
+import exam_script_fig8 as fig8  # the chart functions that are measured
+from data_cache import CACHE_DIR_NAME, plot_columns, read_plot_excel
+from static_export import save_chart
+from tidy_store import faceted_chart, load_tidy
+
+
+def synthetic_frame(columns, rows, rng):
+    """
+    Ragged X/Y columns like the export: the curve columns have `rows` values,
+    the points and population columns about 40, the rest of these columns is empty.
+    columns: {'X1': 'curve', 'X0': 'points', ...} kind of every X column
+    """
+    data = {}
+    for x_name, kind in columns.items():
+        y_name = 'Y' + x_name[1:]
+        n = rows if kind == 'curve' else min(rows, 40)
+        length = np.linspace(10.0, 60.0, n)
+        if kind == 'counts':
+            values = rng.poisson(1000 * np.exp(-((length - 35.0) / 10.0) ** 2)).astype(float)
+        else:
+            values = 1.0 / (1.0 + np.exp(-(length - 30.0) / 4.0))
+            if kind == 'points':
+                values = np.clip(values + rng.normal(0.0, 0.05, n), 0.0, 1.0)
+        data[x_name] = pd.Series(length)
+        data[y_name] = pd.Series(values)
+    return pd.DataFrame(data).reindex(range(rows))
+
+
+def write_workbook(frame, file_path):
+    # first row "S = 0" labels and second row headers, as written by the statistical software
+    labels = []
+    for i in range(len(frame.columns) // 2):
+        labels += [f'S = {i}', None]
+    header = pd.DataFrame([labels, list(frame.columns)], columns=frame.columns)
+    pd.concat([header, frame], ignore_index=True).to_excel(file_path, header=False, index=False)
+
+
+def make_workbooks(folder, rows, meshes, species, seed=0):
+    """
+    Write the synthetic workbooks, returns the catch share and selection curve paths.
+    """
+    rng = np.random.default_rng(seed)
+    catch_share_paths, sel_cur_paths = [], []
+    for s in range(species):
+        for m in range(meshes):
+            mesh = f'MB{10 + 2 * m}'
+            catch_share = synthetic_frame({'X0': 'points', 'X1': 'curve', 'X2': 'counts', 'X3': 'counts'}, rows, rng)
+            sel_cur = synthetic_frame({f'X{i}': 'curve' for i in range(6)}, rows, rng)
+            catch_share_paths.append(os.path.join(folder, f'c_share_species{s}_{mesh}_22.xlsx'))
+            sel_cur_paths.append(os.path.join(folder, f'sel_cur_species{s}_{mesh}_22.xlsx'))
+            write_workbook(catch_share, catch_share_paths[-1])
+            write_workbook(sel_cur, sel_cur_paths[-1])
+    return catch_share_paths, sel_cur_paths
+
+
+def measure(function, repeat=3):
+    """
+    Run function `repeat` times for the best time and once more under tracemalloc
+    for the peak memory. Returns (result, seconds, peak bytes).
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def panel_stages(path, layers_function, build_function, out_dir, repeat, simplify=False):
+    # one record per stage of generate_chart1 / generate_chart2
+    stages = {}
+    raw, seconds, peak = measure(lambda: pd.read_excel(path, header=1), repeat)
+    stages['read_excel'] = (seconds, peak)
+    _, seconds, peak = measure(lambda: raw.apply(pd.to_numeric, errors='coerce'), repeat)
+    stages['to_numeric'] = (seconds, peak)
+    data, seconds, peak = measure(lambda: read_plot_excel(path, plot_columns(path)), repeat)
+    stages['read_typed'] = (seconds, peak)
+    (title, layers), seconds, peak = measure(lambda: layers_function(path, simplify, data), repeat)
+    stages['layers'] = (seconds, peak)
+    chart, seconds, peak = measure(lambda: build_function(*layers, title), repeat)
+    stages['spec_build'] = (seconds, peak)
+    _, seconds, peak = measure(lambda: chart.to_dict(), repeat)
+    stages['to_dict'] = (seconds, peak)
+    html = os.path.join(out_dir, os.path.basename(path) + '.html')
+    _, seconds, peak = measure(lambda: save_chart(chart, html), repeat)
+    stages['save_html'] = (seconds, peak)
+    stages['html_bytes'] = os.path.getsize(html)
+    return stages
+
+
+def first_species(tidy):
+    # faceted_chart draws one species, the synthetic workbooks all have the same year
+    # (the synthetic species names are not in FIGURE8_SPECIES, so load_tidy gets species=None)
+    return tidy[tidy['species'] == tidy['species'].cat.categories[0]]
+
+
+def run_size(rows, meshes, species, repeat, workers, simplify=False):
+    """
+    Benchmark one size, returns a list of result records.
+    simplify: downsample the modelled curves in every stage (curve_simplify.py)
+    """
+    records = []
+    size = {'rows': rows, 'meshes': meshes, 'species': species, 'simplify': simplify}
+    with tempfile.TemporaryDirectory() as folder:
+        catch_share_paths, sel_cur_paths = make_workbooks(folder, rows, meshes, species)
+
+        for benchmark, path, layers_function, build_function in [
+                ('generate_chart1', catch_share_paths[0], fig8.catch_share_layers, fig8.build_chart1),
+                ('generate_chart2', sel_cur_paths[0], fig8.sel_cur_layers, fig8.build_chart2)]:
+            stages = panel_stages(path, layers_function, build_function, folder, repeat, simplify)
+            html_bytes = stages.pop('html_bytes')
+            for stage, (seconds, peak) in stages.items():
+                records.append(dict(size, benchmark=benchmark, stage=stage, seconds=seconds, peak_bytes=peak))
+            records.append(dict(size, benchmark=benchmark, stage='html_size', bytes=html_bytes))
+
+        # the whole figure with an empty cache (excel is parsed), with a warm cache, in parallel and from templates
+        def cold():
+            shutil.rmtree(os.path.join(folder, CACHE_DIR_NAME), ignore_errors=True)
+            return fig8.generate_combined_chart(catch_share_paths, sel_cur_paths, simplify=simplify)
+
+        def faceted():
+            return faceted_chart(first_species(load_tidy(folder, simplify=simplify, species=None))).to_dict()
+
+        html = os.path.join(folder, 'combined.html')
+        figure_stages = [
+            ('combined_cold', cold),
+            ('combined_warm', lambda: fig8.generate_combined_chart(catch_share_paths, sel_cur_paths,
+                                                                   simplify=simplify)),
+            ('combined_parallel', lambda: fig8.generate_combined_chart(catch_share_paths, sel_cur_paths,
+                                                                       workers=workers, simplify=simplify)),
+            ('combined_template', lambda: fig8.generate_combined_spec(catch_share_paths, sel_cur_paths,
+                                                                      simplify=simplify)),
+            ('combined_template_parallel', lambda: fig8.generate_combined_spec(catch_share_paths, sel_cur_paths,
+                                                                               simplify=simplify, workers=workers)),
+            ('combined_faceted', faceted),
+        ]
+        for stage, function in figure_stages:
+            chart, seconds, peak = measure(function, repeat)
+            records.append(dict(size, benchmark='generate_combined_chart', stage=stage, seconds=seconds, peak_bytes=peak))
+            if stage == 'combined_cold':
+                _, seconds, peak = measure(lambda: chart.to_dict(), repeat)
+                records.append(dict(size, benchmark='generate_combined_chart', stage='combined_to_dict',
+                                    seconds=seconds, peak_bytes=peak))
+                _, seconds, peak = measure(lambda: save_chart(chart, html), repeat)
+                records.append(dict(size, benchmark='generate_combined_chart', stage='combined_save_html',
+                                    seconds=seconds, peak_bytes=peak))
+                records.append(dict(size, benchmark='generate_combined_chart', stage='html_size',
+                                    bytes=os.path.getsize(html)))
+            elif stage == 'combined_template':  # the spec the scripts save (exam_script_fig8.py, render_figures.py)
+                template_html = os.path.join(folder, 'combined_template.html')
+                _, seconds, peak = measure(lambda: save_chart(chart, template_html), repeat)
+                records.append(dict(size, benchmark='generate_combined_chart', stage='combined_template_save_html',
+                                    seconds=seconds, peak_bytes=peak))
+                records.append(dict(size, benchmark='generate_combined_chart', stage='template_html_size',
+                                    bytes=os.path.getsize(template_html)))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the chart pipeline on synthetic workbooks.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 4000], help='rows of the curve columns')
+    parser.add_argument('--meshes', type=int, nargs='+', default=[3], help='mesh sizes per species')
+    parser.add_argument('--species', type=int, nargs='+', default=[1], help='number of species')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best time is reported')
+    parser.add_argument('--workers', type=int, default=4, help='workers for the parallel mode')
+    parser.add_argument('--simplify', action='store_true',
+                        help='downsample the modelled curves in every stage (default: the full curves, as the scripts)')
+    parser.add_argument('-o', '--output', help='JSON lines file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for species in args.species:
+            for meshes in args.meshes:
+                for rows in args.rows:
+                    for record in run_size(rows, meshes, species, args.repeat, args.workers, args.simplify):
+                        output.write(json.dumps(record) + '\n')
+                    output.flush()
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
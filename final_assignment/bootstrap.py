@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Double bootstrap confidence bands for the fitted selection and catch share curves.
+
+This replaces the bootstrap of the external statistical software for the dashed 95% limits
+of generate_chart2 (X1/Y1 lower, X2/Y2 upper). As is standard in trawl selectivity work the
+resampling is done in two stages (Millar 1993):
+    1. hauls are drawn with replacement (between haul variation)
+    2. within each drawn haul the fish are resampled over the length classes (multinomial)
+Every replicate is then refitted with selection_fit.fit_counts and the limits are the 2.5%
+and 97.5% percentiles of the replicate curves at each length.
+
+The replicates are split into blocks of a fixed size. Each block gets its own seed from
+numpy's SeedSequence and does its resampling in one batched multinomial draw, the blocks
+are run in a process pool. Since the blocks and their seeds do not depend on the number of
+workers, the bands are exactly the same for any worker count and between runs.
+"""
+
+import os                                            # os for the number of cpus
+from concurrent.futures import ProcessPoolExecutor   # process pool for the replicate blocks
+
+import numpy as np   # numpy for the batched resampling
+
+from selection_fit import curve_grid, fit_counts, fit_selection, fit_catch_share, model_curve, selection_curve_frame
+
+BLOCK_SIZE = 50  # replicates per block (and per seed), fixed so the results do not depend on the workers
+
+
+def haul_counts(raw, columns):
+    """
+    Counts per haul and length class: returns the sorted length classes and an array
+    of shape (hauls, 2 * lengths) with the two count columns side by side.
+    """
+    tables = [raw.pivot_table(index='haul', columns='length', values=column, aggfunc='sum', fill_value=0)
+              for column in columns]
+    length = tables[0].columns.union(tables[1].columns)
+    tables = [table.reindex(columns=length, fill_value=0) for table in tables]
+    return length.to_numpy(dtype=float), np.hstack([table.to_numpy(dtype=float) for table in tables])
+
+
+def resample_counts(counts, n_replicates, rng):
+    """
+    Double bootstrap of a (hauls, cells) count array, batched for n_replicates at once.
+    Returns the resampled counts summed over hauls, shape (n_replicates, cells).
+    """
+    n_hauls = counts.shape[0]
+    totals = counts.sum(axis=1)
+    shares = counts / np.where(totals > 0, totals, 1.0)[:, None]
+    # stage 1: hauls with replacement, stage 2: fish within each drawn haul
+    hauls = rng.integers(0, n_hauls, size=(n_replicates, n_hauls))
+    fish = rng.multinomial(totals[hauls].astype(np.int64), shares[hauls])
+    return fish.sum(axis=1)
+
+
+def _run_block(task):
+    # one block of replicates, top level so the process pool can pickle it
+    seed, n_replicates, counts, length, model, paired, start = task
+    rng = np.random.default_rng(seed)
+    resampled = resample_counts(counts, n_replicates, rng)
+    n_lengths = len(length)
+    thetas = [
+        fit_counts(length, replicate[:n_lengths], replicate[n_lengths:], model=model, paired=paired,
+                   start=start, covariance=False)['theta']
+        for replicate in resampled
+    ]
+    return np.array(thetas)
+
+
+def bootstrap_thetas(counts, length, fit, n_replicates=1000, seed=0, workers=None):
+    """
+    Fitted parameters (theta) of n_replicates double bootstrap replicates, shape (n_replicates, parameters).
+
+    counts, length: from haul_counts
+    fit: the fit to the full data (model, paired and start values are taken from it)
+    seed: the same seed gives the same replicates for any number of workers
+    workers: processes to use, None for all cpus, 1 runs without a pool
+    """
+    n_blocks = -(-n_replicates // BLOCK_SIZE)  # ceiling division
+    seeds = np.random.SeedSequence(seed).spawn(n_blocks)
+    tasks = [
+        (seeds[block], min(BLOCK_SIZE, n_replicates - block * BLOCK_SIZE), counts, length,
+         fit['model'], fit['paired'], fit['theta'])
+        for block in range(n_blocks)
+    ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and n_blocks > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, n_blocks)) as pool:
+            blocks = list(pool.map(_run_block, tasks))  # map keeps the block order
+    else:
+        blocks = [_run_block(task) for task in tasks]
+    return np.vstack(blocks)
+
+
+def percentile_band(thetas, grid, model, paired, level=0.95):
+    """
+    Lower and upper percentile limits of the replicate curves at each grid length.
+    All replicate curves are evaluated at once.
+    """
+    curves = model_curve(thetas.T[:, :, None], grid, model, paired)  # shape (replicates, grid)
+    tail = (1.0 - level) / 2.0 * 100.0
+    lower, upper = np.nanpercentile(curves, [tail, 100.0 - tail], axis=0)
+    return lower, upper
+
+
+def bootstrap_selection_frame(raw, model='logistic', n_replicates=1000, seed=0, workers=None, step=0.1):
+    """
+    Fit raw covered codend counts (haul, length, retained, escaped) and return
+    (fit, frame for generate_chart2) with double bootstrap 95% limits in X1/Y1 and X2/Y2.
+    """
+    fit = fit_selection(raw, model)
+    length, counts = haul_counts(raw, ['retained', 'escaped'])
+    thetas = bootstrap_thetas(counts, length, fit, n_replicates, seed, workers)
+    grid = curve_grid(length, step)
+    lower, upper = percentile_band(thetas, grid, fit['model'], fit['paired'])
+    return fit, selection_curve_frame(fit, grid, lower, upper)
+
+
+def bootstrap_catch_share_band(raw, model='logistic', n_replicates=1000, seed=0, workers=None, step=0.1):
+    """
+    Fit raw paired gear counts (haul, length, test, control) and return
+    (fit, grid, lower, upper) with the double bootstrap 95% limits of the catch share curve.
+    """
+    fit = fit_catch_share(raw, model)
+    length, counts = haul_counts(raw, ['test', 'control'])
+    thetas = bootstrap_thetas(counts, length, fit, n_replicates, seed, workers)
+    grid = curve_grid(length, step)
+    lower, upper = percentile_band(thetas, grid, fit['model'], fit['paired'])
+    return fit, grid, lower, upper
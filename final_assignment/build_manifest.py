@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental builds: skip figures whose inputs did not change.
+
+Every saved figure gets a content hash in a manifest file (.build_manifest.json in
+the output folder). The hash covers the bytes of the input workbooks, the chart
+parameters (the source code of the whole modules that read, prepare, build and save
+the figure, where the domains, axis values and sizes are set, plus options like simplify)
+and the versions of python and of the libraries that parse the workbooks or render the
+figure (PACKAGES).
+A figure is only rebuilt when its hash differs from the recorded one or the
+output file is missing.
+"""
+
+import hashlib   # hashlib for the content hashes
+import inspect   # inspect to include the chart code in the hash
+import json      # json for the manifest file
+import os        # os for paths
+import platform  # platform for the python version
+from importlib import metadata  # versions of the installed libraries
+
+MANIFEST_NAME = '.build_manifest.json'
+
+# libraries whose version changes the figures: parsing (openpyxl, numpy, pandas, pyarrow for the
+# cache), the spec (altair) and the svg/png/pdf export (vl-convert)
+PACKAGES = ('altair', 'numpy', 'openpyxl', 'pandas', 'pyarrow', 'vl-convert-python')
+
+
+def _file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:  # optional libraries (pyarrow, vl-convert)
+        return 'none'
+
+
+def build_hash(input_paths, modules=(), params=None):
+    """
+    Return the content hash of one figure.
+
+    input_paths: workbooks the figure is made from (None entries are skipped)
+    modules: modules that make the figure (loading, chart code, export), their whole source is hashed,
+    so a change in any helper function rebuilds the figure
+    params: other options that change the output, e.g. {'simplify': True}
+    """
+    digest = hashlib.sha256()
+    for path in input_paths:
+        if path is not None:
+            digest.update(os.path.basename(path).encode('utf-8'))  # the title comes from the file name
+            digest.update(_file_digest(path).encode('ascii'))
+    for module in modules:
+        digest.update(inspect.getsource(module).encode('utf-8'))
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode('utf-8'))
+    versions = [platform.python_version()] + [f'{name}={_package_version(name)}' for name in PACKAGES]
+    digest.update('|'.join(versions).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _manifest_path(output_path):
+    # one manifest per output folder
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), MANIFEST_NAME)
+
+
+def load_manifest(output_path):
+    """
+    Return the recorded {file name: hash} entries of the folder output_path is saved in.
+    """
+    try:
+        with open(_manifest_path(output_path), encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):  # first build or broken manifest, rebuild everything
+        return {}
+
+
+def is_current(output_path, digest):
+    """
+    True if output_path exists and was built from inputs with this hash.
+    """
+    recorded = load_manifest(output_path).get(os.path.basename(output_path))
+    return recorded == digest and os.path.exists(output_path)
+
+
+def record_build(output_path, digest):
+    """
+    Record the hash of a saved figure. Called after every figure,
+    so an interrupted batch keeps what was already built.
+    """
+    entries = load_manifest(output_path)
+    entries[os.path.basename(output_path)] = digest
+    manifest_path = _manifest_path(output_path)
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as file:
+        json.dump(entries, file, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled chart templates: build and validate a chart spec once, then only swap data and titles.
+
+The chart functions rebuild the same altair object tree (marks, encodings, scales, axes,
+layers) for every workbook, and altair validates the whole tree against the vega-lite schema
+in to_dict(). On large figure grids that takes longer than loading the data. A template is
+the chart built once with alt.NamedData placeholders and placeholder titles, converted
+(and validated) with to_dict() once. bind_template() then copies the plain dict spec and
+puts in the dataset names and titles of one panel, without altair objects or validation.
+
+The datasets are stored once in the top-level "datasets" map under a name made from their
+content (like altair does), so identical data is only written once. With a name prefix the
+datasets get fixed names instead (<prefix><placeholder>), for a page where the data of a
+name is later replaced (preview_server.py).
+"""
+
+import hashlib   # hashlib for the dataset names
+import json      # json for hashing the dataset values
+
+import altair as alt  # altair for the one time compilation of the templates
+from altair.utils.html import spec_to_html  # same html output as chart.save()
+
+
+def compile_template(chart, nested=False):
+    """
+    Convert a chart built with alt.NamedData placeholders into a (validated) spec dict.
+    nested: True for a part of a larger figure (e.g. one row), the top-level only keys
+    ($schema, default config) are then left out.
+    The returned dict is shared, bind_template never changes it.
+    """
+    spec = chart.to_dict()
+    if nested:
+        spec.pop('$schema', None)
+        spec.pop('config', None)
+    return spec
+
+
+def dataset_values(frame):
+    """
+    Rows of a data frame as a list of dicts, missing values (NaN) as null.
+    """
+    columns = list(frame.columns)
+    rows = frame.to_numpy(dtype=object, copy=True)
+    rows[frame.isna().to_numpy()] = None
+    return [dict(zip(columns, row)) for row in rows.tolist()]
+
+
+def dataset_name(values):
+    # content based name, identical data gets the same name and is stored once
+    text = json.dumps(values, sort_keys=True, separators=(',', ':'))
+    return 'data-' + hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def _substitute(node, names, titles):
+    # copy of the spec with the placeholder dataset names and titles replaced
+    if isinstance(node, dict):
+        if set(node) == {'name'} and node['name'] in names:
+            return {'name': names[node['name']]}
+        return {key: (titles.get(value, value) if key == 'title' and isinstance(value, str)
+                      else _substitute(value, names, titles))
+                for key, value in node.items()}
+    if isinstance(node, list):
+        return [_substitute(value, names, titles) for value in node]
+    return node
+
+
+def bind_template(template, data, titles, datasets, prefix=None):
+    """
+    Return a copy of template with its data and titles filled in.
+
+    data: {placeholder name: data frame}
+    titles: {placeholder title: title}
+    datasets: dict of the whole figure, the values of each data frame are added to it
+    prefix: if given the datasets are named <prefix><placeholder> instead of by their content
+    """
+    names = {}
+    for placeholder, frame in data.items():
+        values = dataset_values(frame)
+        name = dataset_name(values) if prefix is None else prefix + placeholder
+        datasets.setdefault(name, values)
+        names[placeholder] = name
+    return _substitute(template, names, titles)
+
+
+def spec_html(spec):
+    """
+    Html page for a spec dict, the same as chart.save('...html') gives for the chart.
+    """
+    return spec_to_html(spec, mode='vega-lite', vega_version=alt.VEGA_VERSION,
+                        vegaembed_version=alt.VEGAEMBED_VERSION, vegalite_version=alt.VEGALITE_VERSION)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Optional downsampling of the modelled curves before they are plotted.
+
+The statistical software exports the catch share and selection curves with
+thousands of points, far more than a 400x250 panel can show. simplify_line
+runs the Douglas-Peucker algorithm in pixel units: the x and y values are scaled
+with the chart domain and size, and only the points needed to keep the drawn line
+within `tolerance` pixels of the full curve are kept. With the default half pixel
+tolerance the simplified curve can not be told apart from the full one on screen,
+so L50 and the edges of the confidence bands stay where they were.
+"""
+
+import numpy as np   # numpy for the vectorized distance calculations
+
+
+def douglas_peucker(px, py, tolerance):
+    """
+    Return a boolean mask of the points to keep from the polyline (px, py).
+    The first and last point are always kept. Each segment is split at its
+    farthest point until no point is farther than `tolerance` from its segment.
+    """
+    n = len(px)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx = px[end] - px[start]
+        dy = py[end] - py[start]
+        seg_x = px[start + 1:end] - px[start]
+        seg_y = py[start + 1:end] - py[start]
+        length = np.hypot(dx, dy)
+        if length == 0:  # start and end on the same pixel, use the distance to that point
+            dist = np.hypot(seg_x, seg_y)
+        else:  # perpendicular distance to the line through start and end
+            dist = np.abs(seg_x * dy - seg_y * dx) / length
+        farthest = int(np.argmax(dist))
+        if dist[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_line(data, x, y, x_domain, y_domain, width=400, height=250, tolerance=0.5):
+    """
+    Simplify the line (x, y) of a layer data frame for a chart of the given size.
+
+    data: frame with the x and y columns, as returned by data_cache.layer_data
+    x_domain, y_domain: scale domains of the chart, e.g. [15, 55] and [0, 1.01]
+    width, height: chart size in pixels
+    tolerance: largest allowed distance (in pixels) between the full and simplified line
+
+    The frame is sorted by x first, the same order vega-lite draws the line in.
+    Rows with a missing x or y break the line, so each unbroken run is simplified on its own
+    and the breaks are kept.
+    """
+    data = data.sort_values(x, kind='stable').reset_index(drop=True)
+    xs = data[x].to_numpy(dtype=float)
+    ys = data[y].to_numpy(dtype=float)
+
+    # scale to pixels, y is flipped in the chart but the distances are the same
+    px = (xs - x_domain[0]) / (x_domain[1] - x_domain[0]) * width
+    py = (ys - y_domain[0]) / (y_domain[1] - y_domain[0]) * height
+
+    valid = np.isfinite(px) & np.isfinite(py)
+    keep = ~valid  # line breaks are always kept
+    # split the valid points into unbroken runs and simplify each run
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.astype(np.int8), [0]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        keep[start:end] = douglas_peucker(px[start:end], py[start:end], tolerance)
+
+    return data[keep].reset_index(drop=True)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Summary metrics of the plotted curves, kept in a SQLite index next to the figures.
+
+Instead of reading L50 or the selection range off the figures by eye, the metrics are
+computed from the same curve columns the chart functions plot and stored per species,
+mesh and year, so meshes and studies can be compared with one query:
+
+    selection curve (sel_cur_*, X0/Y0 curve, X1/Y1 and X2/Y2 95% limits):
+        L25, L50, L75   lengths where the retention probability rises to 0.25, 0.5, 0.75
+        SR              selection range, L75 - L25
+        ci_width_L50    width of the 95% band (upper - lower limit) at L50
+    catch share curve (c_share_*, X1/Y1 curve):
+        cs_min, cs_max  lowest and highest catch share rate
+        cs_L50          length where the catch share first crosses 0.5 (equal catch in both gears),
+                        rising or falling
+
+The lengths are interpolated linearly between the curve points, a level the curve does not
+cross within its length range gives NULL (for L25/L50/L75 also a curve that already starts
+above the level, selection curves rise with length). render_figures.py and exam_script_fig8.py update
+the index (curve_summary.sqlite) every run.
+
+    python curve_summary.py figures/curve_summary.sqlite
+    python curve_summary.py figures/curve_summary.sqlite --species krill --year 22
+"""
+
+import argparse   # argparse for the command line query
+import datetime   # datetime for the time of the last update
+import os         # os for the file names
+import sqlite3    # sqlite3 for the index
+import sys        # sys for the exit code
+from contextlib import closing
+
+import numpy as np   # numpy for the interpolation
+import pandas as pd  # pandas for the query results
+
+from data_cache import load_plot_data, layer_data  # cached loader, the same layers as the charts
+from stage_trace import stage  # optional stage timings
+
+SUMMARY_NAME = 'curve_summary.sqlite'  # index file next to the figures
+
+SELECTION_METRICS = ('L25', 'L50', 'L75', 'SR', 'ci_width_L50')
+CATCH_SHARE_METRICS = ('cs_min', 'cs_max', 'cs_L50')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS curve_summary (
+    species TEXT NOT NULL,
+    mesh TEXT NOT NULL,
+    year TEXT NOT NULL,
+    L25 REAL, L50 REAL, L75 REAL, SR REAL, ci_width_L50 REAL,
+    cs_min REAL, cs_max REAL, cs_L50 REAL,
+    sel_cur_file TEXT, c_share_file TEXT,
+    updated TEXT,
+    PRIMARY KEY (species, mesh, year)
+)
+"""
+
+
+def _curve(data, x, y):
+    # finite points of one curve, sorted by length
+    layer = layer_data(data, [x, y]).dropna()
+    layer = layer.sort_values(x, kind='stable')
+    return layer[x].to_numpy(dtype=float), layer[y].to_numpy(dtype=float)
+
+
+def crossing(x, y, level, rising_only=True):
+    """
+    First length where the curve (x sorted) crosses level, linear between the points.
+    rising_only: only a crossing from below counts, NaN if the curve is already above the level
+    at the first point (selection curves). With False the first crossing in either direction
+    counts (a catch share curve can fall through 0.5).
+    NaN if the curve never reaches the level.
+    """
+    if len(y) == 0:
+        return np.nan
+    if rising_only:
+        hits = np.flatnonzero(y >= level)
+        if len(hits) == 0:
+            return np.nan
+        i = hits[0]
+        if i == 0:
+            return x[0] if y[0] == level else np.nan
+        return x[i - 1] + (level - y[i - 1]) * (x[i] - x[i - 1]) / (y[i] - y[i - 1])
+    if y[0] == level:
+        return x[0]
+    side = np.sign(y - level)
+    hits = np.flatnonzero(side[:-1] != side[1:])  # segments from one side of the level to the other (or onto it)
+    if len(hits) == 0:
+        return np.nan
+    i = hits[0]
+    return x[i] + (level - y[i]) * (x[i + 1] - x[i]) / (y[i + 1] - y[i])
+
+
+def _value_at(x, y, length):
+    # curve value at one length, NaN outside the curve
+    if np.isnan(length) or len(x) == 0 or not x[0] <= length <= x[-1]:
+        return np.nan
+    return float(np.interp(length, x, y))
+
+
+def selection_metrics(data):
+    """
+    L25, L50, L75, SR and ci_width_L50 of a sel_cur_* workbook (data as from load_plot_data).
+    """
+    x, y = _curve(data, 'X0', 'Y0')
+    L25, L50, L75 = (crossing(x, y, level) for level in (0.25, 0.5, 0.75))
+    lower = _value_at(*_curve(data, 'X1', 'Y1'), L50)
+    upper = _value_at(*_curve(data, 'X2', 'Y2'), L50)
+    return {'L25': L25, 'L50': L50, 'L75': L75, 'SR': L75 - L25, 'ci_width_L50': upper - lower}
+
+
+def catch_share_metrics(data):
+    """
+    cs_min, cs_max and cs_L50 of a c_share_* workbook (data as from load_plot_data).
+    """
+    x, y = _curve(data, 'X1', 'Y1')
+    if len(y) == 0:
+        return {'cs_min': np.nan, 'cs_max': np.nan, 'cs_L50': np.nan}
+    return {'cs_min': float(y.min()), 'cs_max': float(y.max()), 'cs_L50': crossing(x, y, 0.5, rising_only=False)}
+
+
+def pair_metrics(catch_share_path, sel_cur_path):
+    """
+    Metrics of one catch share / selection curve pair, either path can be None.
+    The workbooks come from the cache the chart functions filled, so this does not parse them again.
+    """
+    metrics = {}
+    if sel_cur_path is not None:
+        with stage('summary', sel_cur_path):
+            metrics.update(selection_metrics(load_plot_data(sel_cur_path)))
+            metrics['sel_cur_file'] = os.path.basename(sel_cur_path)
+    if catch_share_path is not None:
+        with stage('summary', catch_share_path):
+            metrics.update(catch_share_metrics(load_plot_data(catch_share_path)))
+            metrics['c_share_file'] = os.path.basename(catch_share_path)
+    return metrics
+
+
+def write_summary(db_path, species, mesh, year, metrics):
+    """
+    Insert or update the row of species, mesh and year. Only the given metrics are changed,
+    NaN is stored as NULL.
+    """
+    row = {key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in metrics.items()}
+    row['updated'] = datetime.datetime.now().isoformat(timespec='seconds')
+    columns = ['species', 'mesh', 'year'] + list(row)
+    sql = (f'INSERT INTO curve_summary ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+           f'ON CONFLICT (species, mesh, year) DO UPDATE SET '
+           + ', '.join(f'{column} = excluded.{column}' for column in row))
+    with closing(sqlite3.connect(db_path, timeout=30)) as connection, connection:
+        connection.execute(_SCHEMA)
+        connection.execute(sql, [species, mesh, year] + list(row.values()))
+
+
+def read_summary(db_path, species=None, mesh=None, year=None):
+    """
+    Rows of the index as a data frame, optionally only one species, mesh and/or year.
+    """
+    filters = {'species': species, 'mesh': mesh, 'year': year}
+    where = [f'{column} = ?' for column, value in filters.items() if value is not None]
+    sql = 'SELECT * FROM curve_summary' + (' WHERE ' + ' AND '.join(where) if where else '')
+    with closing(sqlite3.connect(db_path)) as connection:
+        connection.execute(_SCHEMA)
+        summary = pd.read_sql_query(sql, connection, params=[value for value in filters.values() if value is not None])
+    metrics = list(SELECTION_METRICS + CATCH_SHARE_METRICS)
+    summary[metrics] = summary[metrics].astype(float)  # NULL as NaN, also in columns without any value
+    # meshes by size (MB14 before MB100)
+    return summary.sort_values(['species', 'year', 'mesh'], key=lambda column: (
+        column.str[2:].astype(int) if column.name == 'mesh' else column), ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the curve summary index.')
+    parser.add_argument('db_path', help=f'index file ({SUMMARY_NAME} in the figure folder)')
+    parser.add_argument('--species')
+    parser.add_argument('--mesh')
+    parser.add_argument('--year')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db_path):
+        print(f'{args.db_path} does not exist', file=sys.stderr)
+        return 1
+    summary = read_summary(args.db_path, args.species, args.mesh, args.year)
+    columns = ['species', 'mesh', 'year'] + list(SELECTION_METRICS) + list(CATCH_SHARE_METRICS)
+    print(summary[columns].to_string(index=False, float_format='{:.3f}'.format))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Shared loader for the plot data workbooks (c_share_* and sel_cur_*).
+
+Reading the excel files with openpyxl is the slowest step of every plot run,
+so the parsed and numeric converted data frame is kept in a columnar cache
+file (parquet, or pickle when pyarrow is not installed) next to the workbook.
+The cache file name is made from the workbook path, modification time and size,
+so a changed workbook gets a new cache file and the old one is never read again.
+
+The workbooks are parsed row by row with openpyxl in read-only mode. Only the X/Y
+columns the chart type uses are kept (PLOT_COLUMNS), every cell is converted to a
+number while it is read (text that is not a number becomes NaN and is counted), and
+the values go straight into compact float32 arrays. So there is no object copy of the
+whole sheet and no second numeric copy as with read_excel + apply(pd.to_numeric).
+"""
+
+import array          # array for the compact column buffers while parsing
+import hashlib        # hashlib to make the cache key from path, mtime and size
+import os             # os for file stats and paths
+import re             # re for the X/Y column names
+import threading      # threading for unique temporary file names
+import numpy as np    # numpy for the typed columns
+import openpyxl       # openpyxl for streaming the workbooks
+import pandas as pd   # pandas for the data frames and writing the cache
+from plot_files import parse_plot_file  # chart type from the file name
+from stage_trace import stage  # optional stage timings
+
+CACHE_DIR_NAME = '.plot_cache'  # folder created next to the workbooks
+
+# the columns each chart type plots, other columns of the export are not read
+PLOT_COLUMNS = {
+    'c_share': ('X0', 'Y0', 'X1', 'Y1', 'X2', 'Y2', 'X3', 'Y3'),
+    'sel_cur': ('X0', 'Y0', 'X1', 'Y1', 'X2', 'Y2'),
+}
+XY_COLUMN = re.compile(r'^[XY]\d+$')  # workbooks with other names: all X/Y columns
+
+# array typecodes of the supported dtypes
+_TYPECODES = {'float32': 'f', 'float64': 'd'}
+
+# text that read_excel takes as a missing value (not counted as coerced)
+_MISSING_TEXT = {'', '#N/A', '#N/A N/A', '#NA', '-NaN', '-nan', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+                 'n/a', 'nan', 'null'}
+
+
+def _parquet_available():
+    # parquet needs pyarrow, without it the cache falls back to pickle
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def plot_columns(file_path):
+    """
+    The columns read from a workbook: PLOT_COLUMNS of its chart type (c_share / sel_cur),
+    None (all X/Y columns) for other file names.
+    """
+    parsed = parse_plot_file(file_path)
+    return PLOT_COLUMNS.get(parsed[0]) if parsed else None
+
+
+def _digest(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_path(file_path, cache_dir=None, columns=None, dtype='float32'):
+    """
+    Return the cache file path for a workbook, <workbook>_<version>_<variant>.parquet:
+    the version covers the absolute path, mtime (ns) and size of the workbook, so any change
+    in the workbook gives a different cache file, the variant the columns and dtype read
+    (one cache file per variant of the same workbook version).
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    version = _digest(f'{file_path}|{stat.st_mtime_ns}|{stat.st_size}')
+    variant = _digest(f'{columns}|{dtype}')
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    suffix = '.parquet' if _parquet_available() else '.pkl'
+    return os.path.join(cache_dir, f'{stem}_{version}_{variant}{suffix}')
+
+
+def _remove_stale(cached):
+    """
+    Remove the cache files of older versions of the workbook of `cached` (any variant).
+    Cache files of the same version (other columns or dtype) and the temporary files
+    other workers are writing (*.tmp) are kept.
+    """
+    cache_dir, name = os.path.split(cached)
+    stem, version, _ = name.rsplit('.', 1)[0].rsplit('_', 2)
+    # <stem>_<version>_<variant> or <stem>_<digest> (the older naming with one digest)
+    pattern = re.compile(re.escape(stem) + r'_([0-9a-f]{16})(?:_[0-9a-f]{16})?\.(?:parquet|pkl)')
+    for old in os.listdir(cache_dir):
+        match = pattern.fullmatch(old)
+        if match is None or match.group(1) == version:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, old))
+        except FileNotFoundError:  # already removed by another worker
+            pass
+
+
+def _to_number(value):
+    # cell value -> (number, coerced), like pd.to_numeric(errors='coerce') for one cell
+    if value is None:
+        return np.nan, False
+    if isinstance(value, (int, float)):
+        return value, False
+    if isinstance(value, str) and value.strip() in _MISSING_TEXT:
+        return np.nan, False
+    try:
+        return float(value), False
+    except (TypeError, ValueError):  # text (or a date) that is not a number
+        return np.nan, True
+
+
+def read_plot_excel(file_path, columns=None, dtype='float32'):
+    """
+    Read a plot workbook the same way the chart functions always did: skip the first row
+    (S = 0, S = 1 ... labels), take the column names from the second row and convert
+    the cells to numbers, values that can not be converted become NaN.
+
+    columns: names of the columns to read (e.g. PLOT_COLUMNS['sel_cur']), None for all X/Y columns
+    dtype: 'float32' (default, half the memory) or 'float64'
+    The number of cells that were not empty but became NaN is in data.attrs['nan_coerced'].
+    """
+    typecode = _TYPECODES[dtype]
+    with stage('read_excel', file_path) as record:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]  # the first sheet, as read_excel
+            sheet.reset_dimensions()  # some writers store a wrong sheet size, read until the last row
+            rows = sheet.iter_rows(values_only=True)
+            next(rows, None)  # S = 0, S = 1 ... labels
+            header = ['' if name is None else str(name) for name in next(rows, ())]
+            wanted = {}  # column name -> position, the first column of a name wins
+            for position, name in enumerate(header):
+                if (name in columns if columns is not None else XY_COLUMN.match(name)) and name not in wanted:
+                    wanted[name] = position
+            buffers = {name: array.array(typecode) for name in wanted}
+            positions = list(wanted.items())
+            coerced = 0
+            count = 0
+            n_rows = 0  # rows up to the last one with a value in the read columns
+            for row in rows:
+                filled = False
+                for name, position in positions:
+                    cell = row[position] if position < len(row) else None
+                    value, bad = _to_number(cell)
+                    buffers[name].append(value)
+                    coerced += bad
+                    filled = filled or cell is not None
+                count += 1
+                if filled:
+                    n_rows = count
+        finally:
+            workbook.close()
+        # the arrays are used by the frame without a copy, trailing empty rows are left out
+        data = pd.DataFrame({name: np.frombuffer(buffer, dtype=dtype)[:n_rows] for name, buffer in buffers.items()},
+                            columns=list(wanted), copy=False)
+        data.attrs['nan_coerced'] = coerced
+        record['rows'] = n_rows
+        record['nan_coerced'] = coerced
+    return data
+
+
+def load_plot_data(file_path, cache_dir=None, use_cache=True, columns='auto', dtype='float32'):
+    """
+    Load a c_share_* or sel_cur_* workbook as a numeric data frame.
+    Warm calls read the cache file and skip openpyxl completely,
+    the workbook is only parsed again when its path, mtime or size changed.
+    Cache files of older versions of the workbook are removed when a new one is written
+    (the cache files of other columns or dtypes of the same version are kept).
+    columns: 'auto' reads the columns of the chart type (plot_columns), see read_plot_excel for the rest
+    """
+    if columns == 'auto':
+        columns = plot_columns(file_path)
+    if not use_cache:
+        return read_plot_excel(file_path, columns, dtype)
+
+    cached = cache_path(file_path, cache_dir, columns, dtype)
+    if os.path.exists(cached):
+        with stage('cache_read', file_path) as record:
+            data = pd.read_parquet(cached) if cached.endswith('.parquet') else pd.read_pickle(cached)
+            record['rows'] = len(data)
+            record['nan_coerced'] = data.attrs.get('nan_coerced')  # kept in the cache file
+        return data
+
+    data = read_plot_excel(file_path, columns, dtype)
+
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    _remove_stale(cached)  # caches of older versions of this workbook
+
+    # write then rename, so a broken write never looks like a cache hit,
+    # the pid and thread id keep parallel workers from writing the same temporary file
+    tmp = f'{cached}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with stage('cache_write', file_path):
+        if cached.endswith('.parquet'):
+            data.to_parquet(tmp, index=False)
+        else:
+            data.to_pickle(tmp)
+        os.replace(tmp, cached)
+    return data
+
+
+def _round_significant(values, digits, exponent):
+    # values rounded to `digits` significant digits (exponent: floor(log10(|values|)))
+    shift = digits - 1 - exponent
+    scale = 10.0 ** np.abs(shift)
+    return np.where(shift >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+
+
+def _shortest_float64(column):
+    """
+    float32 values as float64 with the shortest decimal that gives the same float32 back
+    (0.389 and not 0.38899999856948853), the same as str() of every value but without strings:
+    each value is rounded to 7, 8 or 9 significant digits, the first that round trips is kept.
+    """
+    values = column.astype(np.float64)
+    todo = np.flatnonzero(np.isfinite(values) & (values != 0))
+    exponent = np.floor(np.log10(np.abs(values[todo])))
+    for digits in (7, 8, 9):  # 9 digits always round trip a float32
+        rounded = _round_significant(values[todo], digits, exponent)
+        exact = rounded.astype(np.float32) == column[todo]
+        values[todo[exact]] = rounded[exact]
+        todo, exponent = todo[~exact], exponent[~exact]
+    return values
+
+
+def layer_data(data, columns):
+    """
+    Return only the columns one chart layer encodes (for example ['X1', 'Y1']).
+    The statistical software pads the shorter series with empty cells down to the
+    longest one, those rows are empty in the selected columns and are dropped here.
+    Altair stores identical data once in the top-level "datasets" of the spec,
+    so layers that use the same columns share one copy in the saved html.
+    float32 columns are returned as float64 with the shortest decimal of each value (_shortest_float64),
+    so the charts get 0.389 and not 0.38899999856948853 (which would also make the html bigger).
+    """
+    layer = data[list(columns)].dropna(how='all').reset_index(drop=True)
+    for column in layer.columns:
+        if layer[column].dtype == np.float32:
+            layer[column] = _shortest_float64(layer[column].to_numpy())
+    return layer
@@ -14,14 +14,27 @@ For paths and other documents please visit:
 
 """
  
-import pandas as pd   # pandas imported for data manipulation
 import altair as alt  # altair for plotting 
 import webbrowser     # webbrowser to open and display the html file with the plots
 import re             # re for regular expression operations (to name titles from file name)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor  # pools for building panels at the same time
+from data_cache import load_plot_data, layer_data  # cached excel loader (skips openpyxl when the workbook did not change)
+                                                   # and per layer data (only the columns a layer uses)
+from curve_simplify import simplify_line  # optional downsampling of the modelled curves
+from plot_files import find_plot_files    # finds and pairs the c_share/sel_cur workbooks in a folder
+from build_manifest import build_hash, is_current, record_build  # incremental builds (skip unchanged figures)
+from static_export import STATIC_FORMATS, save_chart  # svg/png/pdf export without a browser
+from chart_templates import bind_template, compile_template  # charts compiled once, data swapped per panel
+from curve_summary import SUMMARY_NAME, pair_metrics, write_summary  # L50, SR and catch share metrics index
+import functools      # functools for caching the compiled templates
+from stage_trace import panel, stage, start_trace, stop_trace  # optional timings (per file and stage) and profiles
+import os             # os for the data folder path
+import sys            # sys for the command line options
+import data_cache, plot_files, curve_simplify, chart_templates, static_export  # modules hashed for --incremental
 
 
 ### catch share rate function
-def generate_chart1(catch_share_paths):
+def generate_chart1(catch_share_paths, simplify=False, data=None):
     
     """
    Generate the left column chart for catch share rate plot.
@@ -35,21 +48,52 @@ def generate_chart1(catch_share_paths):
    X2 and Y2: Column for population structure (control)
    X3 and Y3: Column for population structure (test)
    all X columns are for length data, statistical software output gives separate columns.
+   
+   simplify: if True the catch share curve (X1, Y1) is downsampled to the points that are
+   visible at the chart size (see curve_simplify.py), for smaller html files and faster rendering.
+   data: already prepared X/Y data (e.g. fitted with selection_fit.fit_catch_share_frame),
+   the workbook is then not read and the path is only used for the title.
    """
+    with panel(catch_share_paths):  # timing (and profile) of the whole panel, only when tracing is on
+        title_suffix1, layers = catch_share_layers(catch_share_paths, simplify, data)
+        with stage('spec_build', catch_share_paths):
+            return build_chart1(*layers, title_suffix1)
+
+
+def catch_share_layers(catch_share_paths, simplify=False, data=None):
+    """
+    Title and layer data of the catch share chart, as (title, [curve, points, test, control]).
+    Arguments as in generate_chart1.
+    """
    # function extracts mesh size from file path for title suffix (from re module)
-    match = re.search(r'c_share_krill_(MB\d+)_', catch_share_paths) #regex search for: MB followed by one or more digits, like MB14. 
+    match = re.search(r'c_share_.+?_(MB\d+)_', catch_share_paths) #regex search for: MB followed by one or more digits, like MB14 (any species). 
     title_suffix1 = match.group(1) if match else 'Unknown' # if the search finds a match it returns match object as title, if not error as Unknown
     
 
-    data = pd.read_excel(catch_share_paths,    # funct. reads excel data into pandas data frame, and paths excel file
-                         header=1)             # skipping first row (index 0) and starts from second row (index 1)due to unused headers
-    data = data.apply(pd.to_numeric,    # applies fun data pd frame, convert numeric
-                      errors='coerce')  # converts non convertible values into NaN(not a number) to prevent conversation fails
+    if data is None:
+        data = load_plot_data(catch_share_paths)  # reads excel data (header=1, numeric with NaN for non convertible values)
+                                                  # from the columnar cache, excel is only parsed again when the file changed
+    with stage('layers', catch_share_paths) as record:
+        #Catch share rate curve
+        catch_share_curve = layer_data(data, ['X1', 'Y1'])
+        if simplify:  # keeps the curve within half a pixel of the full export at 400x250
+            catch_share_curve = simplify_line(catch_share_curve, 'X1', 'Y1', [15, 55], [0, 1.01], width=400, height=250)
+        catch_points = layer_data(data, ['X0', 'Y0'])
+        test_population = layer_data(data, ['X3', 'Y3'])
+        control_population = layer_data(data, ['X2', 'Y2'])
+        record['rows'] = len(catch_share_curve) + len(catch_points) + len(test_population) + len(control_population)
+    return title_suffix1, [catch_share_curve, catch_points, test_population, control_population]
+
+
+def build_chart1(catch_share_curve, catch_points, test_population, control_population, title_suffix1):
+    """
+    Build the catch share chart from its layer data. The data are data frames, or alt.NamedData
+    placeholders when the chart is compiled once as a template (see chart_templates.py).
+    """
     """
     # combine line (catch share rate) and circle (catch share points) for left axis
     """
-    #Catch share rate curve
-    left_axis_chart = alt.Chart(data).mark_line(color='black',  # creates altair chart object as 'data', and mark it as line chart, in black  
+    left_axis_chart = alt.Chart(catch_share_curve).mark_line(color='black',  # creates altair chart object as 'data', and mark it as line chart, in black  
                                                 clip=True,      # to prevent extended data clip chart 
                                                 size=5          # thickness of the line 
                                                 ).encode(       # encode() method used to bind data columns like x, y axis configuration
@@ -70,7 +114,7 @@ def generate_chart1(catch_share_paths):
                           format='.2f', # for two deciamls in y-axis labels
                           grid=False))
         #Catch share points
-    ) + alt.Chart(data).mark_point(shape='circle',  # make point chart with circles
+    ) + alt.Chart(catch_points).mark_point(shape='circle',  # make point chart with circles
                                    clip=True,       
                                    filled=True,     # fill circle
                                    fill='white',    # fill color
@@ -86,7 +130,7 @@ def generate_chart1(catch_share_paths):
     This part here for to combine population structure for control and test nets  
     """
     # dotted population structure (control+test) with right y axis
-    right_axis_chart = alt.Chart(data).mark_line(size = 1,          # creates altair chart object as 'data', and mark it as line chart
+    right_axis_chart = alt.Chart(test_population).mark_line(size = 1,          # creates altair chart object as 'data', and mark it as line chart
                                                  color='darkgrey',  # line color darkgrey
                                                  clip=True).encode( 
         x='X3:Q',       # test data column
@@ -100,7 +144,7 @@ def generate_chart1(catch_share_paths):
                           grid=False,
                           format="d",              # removes comma on thousand sperator 
                           values=[0, 500, 1000, 1500, 2000])) # right y axis labels
-    ) + alt.Chart(data).mark_line(size = 1, 
+    ) + alt.Chart(control_population).mark_line(size = 1, 
                                   color='black', 
                                   clip=True).encode(
         x='X2:Q',       # control data column
@@ -142,15 +186,39 @@ Y2-X2: Upper 95% confidence limit data
 """
 
 ### selection curve function
-def generate_chart2(sel_cur_paths):  # only changed names in this part, logic is the same (line 141-145)
-    match = re.search(r'sel_cur_krill_(MB\d+)_', sel_cur_paths)
+def generate_chart2(sel_cur_paths, simplify=False, data=None):  # only changed names in this part, logic is the same (line 141-145)
+    with panel(sel_cur_paths):
+        title_suffix, layers = sel_cur_layers(sel_cur_paths, simplify, data)
+        with stage('spec_build', sel_cur_paths):
+            return build_chart2(*layers, title_suffix)
+
+
+def sel_cur_layers(sel_cur_paths, simplify=False, data=None):
+    # title and layer data of the selection curve chart, as (title, [main curve, lower limit, upper limit])
+    match = re.search(r'sel_cur_.+?_(MB\d+)_', sel_cur_paths)
     title_suffix = match.group(1) if match else 'Unknown' 
-    data = pd.read_excel(sel_cur_paths, header=1)
-    data = data.apply(pd.to_numeric, errors='coerce')
+    if data is None:  # same as in generate_chart1, data can come from selection_fit.fit_selection_frame
+        data = load_plot_data(sel_cur_paths)
+    
+    with stage('layers', sel_cur_paths) as record:
+        # data for the main curve and the 95% confidence limits
+        main_curve = layer_data(data, ['X0', 'Y0'])
+        lower_limit = layer_data(data, ['X1', 'Y1'])
+        upper_limit = layer_data(data, ['X2', 'Y2'])
+        if simplify:  # same as in generate_chart1, the curves are downsampled to the visible points
+            main_curve = simplify_line(main_curve, 'X0', 'Y0', [15, 55], [0, 1.01], width=400, height=250)
+            lower_limit = simplify_line(lower_limit, 'X1', 'Y1', [15, 55], [0, 1.01], width=400, height=250)
+            upper_limit = simplify_line(upper_limit, 'X2', 'Y2', [15, 55], [0, 1.01], width=400, height=250)
+        record['rows'] = len(main_curve) + len(lower_limit) + len(upper_limit)
+    return title_suffix, [main_curve, lower_limit, upper_limit]
+
+
+def build_chart2(main_curve, lower_limit, upper_limit, title_suffix):
+    # selection curve chart from its layer data (data frames or alt.NamedData, as in build_chart1)
     
     # line chart for selection curve
     
-    chart = alt.Chart(data).mark_line(color='black',                # main curve
+    chart = alt.Chart(main_curve).mark_line(color='black',                # main curve
                                       clip=True, 
                                       size=5).encode(
         x=alt.X('X0:Q', 
@@ -171,7 +239,7 @@ def generate_chart2(sel_cur_paths):  # only changed names in this part, logic is
                           format='.2f', 
                           grid=False))
     
-    ) + alt.Chart(data).mark_line(color='black',                    # lower limit
+    ) + alt.Chart(lower_limit).mark_line(color='black',                    # lower limit
                                   clip=True, 
                                   strokeDash=[5, 5],  #configure dash length and space
                                   size=2
@@ -179,7 +247,7 @@ def generate_chart2(sel_cur_paths):  # only changed names in this part, logic is
         x=alt.X('X1:Q', 
                 scale=alt.Scale(domain=[15, 55])),
         y='Y1:Q'
-    ) + alt.Chart(data).mark_line(color='black',                    # upper limit
+    ) + alt.Chart(upper_limit).mark_line(color='black',                    # upper limit
                                   clip=True, 
                                   strokeDash=[5, 5],
                                   size=2
@@ -206,56 +274,181 @@ combined charts to produce a final visualization. This part ensures each
 pair of charts is displayed together in a coherent and structured layout. 
 """
 
+# one row of the combined chart: catch share chart (left) and selection curve chart (right)
+def generate_row_chart(catch_share, sel_cur):
+    return alt.hconcat(catch_share, 
+                       sel_cur, 
+                       spacing=90).resolve_scale(  # spcaing between charts
+        x='shared', y='independent' # in here x axis is shared because we have one type of y axis data
+    )
+
 # combined chart function
-def generate_combined_chart(catch_share_paths, sel_cur_paths):
-    # generate individual catch share charts for each path
-    catch_share_charts = [generate_chart1(path) for path in catch_share_paths]
-    # generate individual selection curve charts for each path
-    sel_cur_charts = [generate_chart2(path) for path in sel_cur_paths]
+def generate_combined_chart(catch_share_paths, sel_cur_paths, workers=1, use_processes=False, simplify=False):
+    """
+    workers: number of panels loaded and built at the same time, 1 builds them one after another.
+    use_processes: if True a process pool is used instead of a thread pool (excel parsing is
+    mostly python code, so processes scale better when the workbooks are not cached yet).
+    The panels are always joined in the order of the path lists, so the output is the same
+    for any number of workers.
+    simplify: passed to generate_chart1 and generate_chart2 (downsampling of the modelled curves).
+    """
+    if workers > 1:
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            # submit all catch share and selection curve panels at once, results keep the list order
+            catch_share_jobs = [pool.submit(generate_chart1, path, simplify) for path in catch_share_paths]
+            sel_cur_jobs = [pool.submit(generate_chart2, path, simplify) for path in sel_cur_paths]
+            catch_share_charts = [job.result() for job in catch_share_jobs]
+            sel_cur_charts = [job.result() for job in sel_cur_jobs]
+    else:
+        # generate individual catch share charts for each path
+        catch_share_charts = [generate_chart1(path, simplify) for path in catch_share_paths]
+        # generate individual selection curve charts for each path
+        sel_cur_charts = [generate_chart2(path, simplify) for path in sel_cur_paths]
     
     # create a list of combined charts for each pair of catch share and selection curve charts
     combined_row_charts = [
-        alt.hconcat(catch_share, 
-                    sel_cur, 
-                    spacing=90).resolve_scale(  # spcaing between charts
-            x='shared', y='independent' # in here x axis is shared because we have one type of y axis data
-        ) for catch_share, sel_cur in zip(catch_share_charts, # zip() takes two lists and return a tuple 
-                                          sel_cur_charts)
+        generate_row_chart(catch_share, sel_cur)
+        for catch_share, sel_cur in zip(catch_share_charts, # zip() takes two lists and return a tuple 
+                                        sel_cur_charts)
     ]
     
+    with stage('combine'):
+        combined_chart = stack_rows(combined_row_charts)
+    
+    return combined_chart  # return final combined chart
+
+# all rows of the combined chart below each other
+def stack_rows(combined_row_charts):
     # vertically concatenated all combined row charts
-    combined_chart = alt.vconcat(*combined_row_charts, # alt.vconcat() method vertically concatenate  charts
-                                 spacing=50).configure_view(
+    return alt.vconcat(*combined_row_charts, # alt.vconcat() method vertically concatenate  charts
+                       spacing=50).configure_view(
         stroke=None  # remove the border around the charts
     )
-    
-    return combined_chart  # return final combined chart
 
-# file paths - all functions are calling the file paths here ands runs each file in order
-# for file paths please go:
-    # https://github.com/eniskostak/enk/tree/5430375cd7d59082ef7955eb9ce14132a9334312/final_assignment
-catch_share_paths = [
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_krill_MB14_22.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_krill_MB20_22.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\c_share\c_share_krill_MB30_22.xlsx',
-]
-
-sel_cur_paths = [
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\sel_cur\sel_cur_krill_MB14_22.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\sel_cur\sel_cur_krill_MB20_22.xlsx',
-    r'C:\Users\eko067\Desktop\My Paper - Presentation etc\Paper\meso_sel_study\DATA\sup files\plot_data\sel_cur\sel_cur_krill_MB30_22.xlsx',
-]
-
-# generate the combined chart
-combined_chart = generate_combined_chart(catch_share_paths, sel_cur_paths) # calls functions
-combined_chart = combined_chart.properties(
-    title='Krill' # sets title as header to the plot 
-)
-combined_chart = combined_chart.configure_title(fontSize=30) # title font size
-# generate charts to html
-combined_chart_file = "figure8_exam.html" # assigns the file name in to the variable
-combined_chart.save(combined_chart_file)  # saves the plots as HTML file
-webbrowser.open(combined_chart_file)      # opens the saved HTML file in the web browser to display the chart
+"""
+The same combined chart from compiled templates (see chart_templates.py). The row chart
+(catch share + selection curve) and the figure settings are built and validated with altair
+only once, every row then gets its data and titles put into a copy of the compiled spec.
+For large figure grids this is much faster than building and validating every chart again.
+"""
+
+# placeholder names of the layer data in the templates (same order as catch_share_layers / sel_cur_layers)
+CATCH_SHARE_LAYERS = ('catch_share_curve', 'catch_points', 'test_population', 'control_population')
+SEL_CUR_LAYERS = ('main_curve', 'lower_limit', 'upper_limit')
+
+@functools.lru_cache(maxsize=None)
+def row_template():
+    catch_share = build_chart1(*[alt.NamedData(name=name) for name in CATCH_SHARE_LAYERS], '{catch_share_title}')
+    sel_cur = build_chart2(*[alt.NamedData(name=name) for name in SEL_CUR_LAYERS], '{sel_cur_title}')
+    return compile_template(generate_row_chart(catch_share, sel_cur), nested=True)
+
+@functools.lru_cache(maxsize=None)
+def figure_template(title=None, title_font_size=None):
+    figure = stack_rows([])
+    if title is not None:
+        figure = figure.properties(title=title)
+    if title_font_size is not None:
+        figure = figure.configure_title(fontSize=title_font_size)
+    return compile_template(figure)
+
+# fixed dataset names of one row (generate_combined_spec with stable_names=True), e.g. row0_main_curve
+def row_prefix(row):
+    return f'row{row}_'
+
+def _panel_layers(layers_function, path, simplify):
+    # title and layer data of one panel (catch_share_layers or sel_cur_layers), a pool job of generate_combined_spec
+    with panel(path):
+        return layers_function(path, simplify)
+
+def generate_combined_spec(catch_share_paths, sel_cur_paths, simplify=False, title=None, title_font_size=None,
+                           stable_names=False, workers=1, use_processes=False):
+    """
+    Vega-lite spec (dict) of the combined chart, the same as
+    generate_combined_chart(...).properties(title=title).configure_title(fontSize=title_font_size).to_dict()
+    but built from the compiled templates. save_chart (static_export.py) saves it like a chart.
+    stable_names: name the datasets by row and layer (row_prefix) instead of by content,
+    so the data of one panel can be replaced in an open page (preview_server.py).
+    workers, use_processes: as in generate_combined_chart, the layer data of the panels is loaded
+    in a thread (or process) pool, the templates are then bound in the order of the path lists.
+    """
+    if workers > 1:
+        pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            catch_share_jobs = [pool.submit(_panel_layers, catch_share_layers, path, simplify)
+                                for path in catch_share_paths]
+            sel_cur_jobs = [pool.submit(_panel_layers, sel_cur_layers, path, simplify) for path in sel_cur_paths]
+            panels = [(catch_share_job.result(), sel_cur_job.result())
+                      for catch_share_job, sel_cur_job in zip(catch_share_jobs, sel_cur_jobs)]
+    else:
+        panels = [(_panel_layers(catch_share_layers, catch_share_path, simplify),
+                   _panel_layers(sel_cur_layers, sel_cur_path, simplify))
+                  for catch_share_path, sel_cur_path in zip(catch_share_paths, sel_cur_paths)]
+
+    datasets = {}
+    rows = []
+    for row, (catch_share_path, panel_layers) in enumerate(zip(catch_share_paths, panels)):
+        (catch_share_title, catch_share_data), (sel_cur_title, sel_cur_data) = panel_layers
+        with stage('template_bind', catch_share_path):
+            data = dict(zip(CATCH_SHARE_LAYERS, catch_share_data))
+            data.update(zip(SEL_CUR_LAYERS, sel_cur_data))
+            titles = {'{catch_share_title}': catch_share_title, '{sel_cur_title}': sel_cur_title}
+            rows.append(bind_template(row_template(), data, titles, datasets,
+                                      row_prefix(row) if stable_names else None))
+
+    spec = dict(figure_template(title, title_font_size))  # the template itself is not changed
+    spec['vconcat'] = rows
+    spec['datasets'] = datasets
+    return spec
+
+# everything that changes the figures, hashed for the incremental builds (build_manifest.py):
+# this script and the modules that load, downsample, bind and save the data (their whole source)
+CHART_MODULES = (sys.modules[__name__], data_cache, plot_files, curve_simplify, chart_templates, static_export)
+
+# the part below only runs when the script is started directly (not when it is imported,
+# or re-imported by the worker processes of generate_combined_chart and generate_combined_spec)
+if __name__ == '__main__':
+    # file paths - the krill workbooks are read from the data folder next to this script
+    # (c_share_krill_MB*_22.xlsx and sel_cur_krill_MB*_22.xlsx), for the data please go:
+        # https://github.com/eniskostak/enk/tree/5430375cd7d59082ef7955eb9ce14132a9334312/final_assignment
+    # for other folders or headless batch runs use render_figures.py
+    # --trace writes the stage timings of this run to figure8_trace.json (see stage_trace.py)
+    if '--trace' in sys.argv:
+        start_trace()
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    krill_files = [files for files in find_plot_files(data_dir) if files[0] == 'krill' and files[2] == '22']
+    catch_share_paths = [files[3] for files in krill_files]
+    sel_cur_paths = [files[4] for files in krill_files]
+
+    combined_chart_file = "figure8_exam.html" # assigns the file name in to the variable
+    # --svg, --png and --pdf also save the figure in these formats (e.g. figure8_exam.pdf for the journal)
+    static_files = [f'figure8_exam.{output_format}' for output_format in STATIC_FORMATS
+                    if f'--{output_format}' in sys.argv]
+
+    # with --incremental the figure is only rebuilt when a workbook, the chart code or a library version changed
+    figure_hash = build_hash(catch_share_paths + sel_cur_paths, CHART_MODULES,
+                             {'title': 'Krill', 'title_font_size': 30})
+    if '--incremental' in sys.argv and all(is_current(chart_file, figure_hash)
+                                           for chart_file in [combined_chart_file] + static_files):
+        print(f'{combined_chart_file} is up to date')
+    else:
+        # generate the combined chart (from the compiled templates, same as generate_combined_chart)
+        # --parallel loads the panels in a process pool, one worker per cpu core
+        workers = os.cpu_count() if '--parallel' in sys.argv else 1
+        combined_chart = generate_combined_spec(catch_share_paths, sel_cur_paths, # calls functions
+                                                title='Krill',       # sets title as header to the plot
+                                                title_font_size=30,  # title font size
+                                                workers=workers, use_processes=True)
+        # generate charts to html
+        for chart_file in [combined_chart_file] + static_files:
+            save_chart(combined_chart, chart_file)  # saves the plots as HTML file (and svg/png/pdf if asked)
+            record_build(chart_file, figure_hash)
+        webbrowser.open(combined_chart_file)      # opens the saved HTML file in the web browser to display the chart
+    # L50, SR and catch share metrics of every mesh, queried with: python curve_summary.py curve_summary.sqlite
+    for species, mesh, year, catch_share_path, sel_cur_path in krill_files:
+        write_summary(SUMMARY_NAME, species, mesh, year, pair_metrics(catch_share_path, sel_cur_path))
+    if '--trace' in sys.argv:
+        stop_trace('figure8_trace.json')
 
 """
 I chose it to be an html file because it is easy to comare for me the changes
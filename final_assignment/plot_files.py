@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Finding the plot data workbooks on disk.
+
+The statistical software exports are named like c_share_krill_MB14_22.xlsx and
+sel_cur_krill_MB14_22.xlsx: chart type, species, mesh (MB14 = 14 mm belly mesh)
+and year. find_plot_files collects them under a folder and pairs the catch share
+and selection curve workbook of the same species, mesh and year.
+"""
+
+import glob   # glob for finding the workbooks
+import os     # os for paths
+import re     # re for reading species, mesh and year from the file name
+
+# c_share_<species>_<MB..>_<year>.xlsx or sel_cur_<species>_<MB..>_<year>.xlsx
+PLOT_FILE_PATTERN = re.compile(r'^(c_share|sel_cur)_(.+?)_(MB\d+)_(.+)\.xlsx$')
+
+# species the figure 8 charts can draw: the axes of generate_chart1/generate_chart2 (exam_script_fig8.py)
+# and tidy_store.py are set for krill (15-55 mm, up to 2000 caught), the workbooks of other species
+# (e.g. lantern, 15-85 mm, see c_share_all_lantern.py) would be cut off
+FIGURE8_SPECIES = ('krill',)
+
+
+def parse_plot_file(file_path):
+    """
+    Return (chart type, species, mesh, year) for a plot workbook name,
+    or None if the file name does not follow the export naming.
+    """
+    match = PLOT_FILE_PATTERN.match(os.path.basename(file_path))
+    if match is None:
+        return None
+    return match.groups()
+
+
+def _sort_key(key):
+    species, mesh, year = key
+    return species, year, int(mesh[2:])  # MB14 before MB100
+
+
+def find_plot_files(data_dir, recursive=False, species=None):
+    """
+    Find the c_share_* and sel_cur_* workbooks in data_dir.
+    species: only the workbooks of these species (e.g. FIGURE8_SPECIES), None for all.
+
+    Returns a list of (species, mesh, year, catch share path, selection curve path)
+    sorted by species, year and mesh size. A workbook without a partner gets None
+    for the missing path, so it can still be plotted on its own.
+    """
+    pattern = os.path.join(data_dir, '**', '*.xlsx') if recursive else os.path.join(data_dir, '*.xlsx')
+    pairs = {}
+    for path in glob.glob(pattern, recursive=recursive):
+        parsed = parse_plot_file(path)
+        if parsed is None:  # other workbooks and excel lock files (~$...)
+            continue
+        chart_type, file_species, mesh, year = parsed
+        if species is not None and file_species not in species:
+            continue
+        paths = pairs.setdefault((file_species, mesh, year), {})
+        if chart_type in paths:
+            raise ValueError(f'two {chart_type} workbooks for {file_species} {mesh} {year}: '
+                             f'{paths[chart_type]} and {path}')
+        paths[chart_type] = path
+
+    return [
+        key + (pairs[key].get('c_share'), pairs[key].get('sel_cur'))
+        for key in sorted(pairs, key=_sort_key)
+    ]
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Live preview of the combined figure (figure 8) in the browser, updated when a workbook changes.
+
+Instead of rerunning the script and opening a new html file after every change, the
+preview server keeps one page open and watches the data folder (and an optional JSON
+file with the chart parameters). When a workbook is saved only its panel is loaded
+again (through the cache of data_cache.py, the other workbooks are not read) and only
+the datasets of that panel are sent to the page, which puts them into the running chart
+with Vega's data change API (view.change). The figure is only rebuilt and sent as a new
+spec when workbooks are added or removed or the parameters change.
+
+The page gets the updates as server-sent events, everything runs on the standard library
+http server, no extra packages are needed. The page loads vega, vega-lite and vega-embed
+from the CDN like the saved html files.
+
+Usage:
+    python preview_server.py data
+    python preview_server.py data --params preview.json --port 8050 --open
+
+preview.json (all keys optional, read again when the file changes):
+    {"simplify": true, "title": "Krill", "title_font_size": 30, "species": "krill", "year": "22"}
+"""
+
+import argparse     # argparse for the command line options
+import json         # json for the parameters and the messages to the page
+import os           # os for file stats
+import queue        # queue for the messages to each open page
+import sys          # sys for the exit code and error messages
+import threading    # threading for the watcher next to the server
+import time         # time for the polling interval
+import webbrowser   # webbrowser for --open
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import altair as alt  # altair for the vega / vega-lite / vega-embed versions of the page
+from chart_templates import dataset_values  # data frame -> dataset values
+from exam_script_fig8 import (CATCH_SHARE_LAYERS, SEL_CUR_LAYERS, catch_share_layers, generate_combined_spec,
+                              row_prefix, sel_cur_layers)
+from plot_files import FIGURE8_SPECIES, find_plot_files  # finds and pairs the workbooks
+
+DEFAULT_PARAMS = {'simplify': False, 'title': None, 'title_font_size': 30, 'species': None, 'year': None}
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>Figure preview</title>
+  <script src="https://cdn.jsdelivr.net/npm/vega@{vega}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@{vegalite}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@{vegaembed}"></script>
+</head>
+<body>
+  <div id="vis"></div>
+  <script>
+    let view = null;
+    let updates = Promise.resolve();  // messages are applied one after another
+
+    async function show(spec) {{
+      if (view) view.finalize();
+      view = (await vegaEmbed('#vis', spec)).view;
+    }}
+
+    async function replaceData(datasets) {{
+      // Vega's data change API: swap the values of the named datasets and run the dataflow again
+      for (const [name, values] of Object.entries(datasets)) {{
+        view.change(name, vega.changeset().remove(vega.truthy).insert(values));
+      }}
+      await view.runAsync();
+    }}
+
+    // the first message is always the whole spec, later ones are new data or a new spec
+    new EventSource('events').onmessage = (event) => {{
+      const message = JSON.parse(event.data);
+      updates = updates.then(() => message.type === 'spec' ? show(message.spec) : replaceData(message.datasets));
+    }};
+  </script>
+</body>
+</html>
+"""
+
+
+def _stat(path):
+    # (mtime, size) of a file, None if it does not exist (any change gives a new value)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Preview:
+    """
+    The figure shown in the preview page and the workbooks it was built from.
+
+    data_dir, recursive: where the workbooks are found (see plot_files.find_plot_files)
+    params_file: JSON file with the chart parameters (DEFAULT_PARAMS), None for the defaults
+    workers: panels loaded at the same time when the whole figure is built (see generate_combined_spec)
+    """
+
+    def __init__(self, data_dir, params_file=None, recursive=False, workers=1):
+        self.data_dir = data_dir
+        self.params_file = params_file
+        self.recursive = recursive
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._clients = []  # one message queue per open page
+        self.build()
+
+    def read_params(self):
+        params = dict(DEFAULT_PARAMS)
+        if self.params_file is not None and os.path.exists(self.params_file):
+            with open(self.params_file, encoding='utf-8') as file:
+                params.update(json.load(file))
+        return params
+
+    def find_pairs(self, params):
+        # the complete catch share / selection curve pairs of the figure, in figure order
+        # (only species the figure 8 axes are set for)
+        found = find_plot_files(self.data_dir, self.recursive, FIGURE8_SPECIES)
+        return [
+            (catch_share_path, sel_cur_path)
+            for species, mesh, year, catch_share_path, sel_cur_path in found
+            if catch_share_path and sel_cur_path
+            and params['species'] in (None, species) and params['year'] in (None, year)
+        ]
+
+    def build(self):
+        """
+        Build the whole spec, with fixed dataset names so single panels can be replaced later.
+        """
+        params = self.read_params()
+        pairs = self.find_pairs(params)
+        spec = generate_combined_spec([pair[0] for pair in pairs], [pair[1] for pair in pairs], params['simplify'],
+                                      params['title'], params['title_font_size'], stable_names=True,
+                                      workers=self.workers)
+        with self._lock:
+            self.params = params
+            self.pairs = pairs
+            self.spec = spec
+            # workbook -> (row, layer names), and the file stats the spec was built from
+            self.panels = {}
+            for row, (catch_share_path, sel_cur_path) in enumerate(pairs):
+                self.panels[catch_share_path] = (row, CATCH_SHARE_LAYERS)
+                self.panels[sel_cur_path] = (row, SEL_CUR_LAYERS)
+            self.stats = {path: _stat(path) for path in self.panels}
+            self.params_stat = _stat(self.params_file) if self.params_file else None
+        return spec
+
+    def panel_datasets(self, path):
+        """
+        Load one workbook again and return its datasets that differ from the page.
+        """
+        row, layer_names = self.panels[path]
+        layers_function = catch_share_layers if layer_names is CATCH_SHARE_LAYERS else sel_cur_layers
+        _, layers = layers_function(path, self.params['simplify'])
+        changed = {}
+        for layer_name, frame in zip(layer_names, layers):
+            name = row_prefix(row) + layer_name
+            values = dataset_values(frame)
+            if values != self.spec['datasets'].get(name):
+                changed[name] = values
+        return changed
+
+    def poll(self):
+        """
+        Check the workbooks and the parameter file once, update the figure and return the
+        message for the page: {'type': 'data', 'datasets': {...}}, {'type': 'spec', 'spec': ...} or None.
+        """
+        params_changed = self.params_file is not None and _stat(self.params_file) != self.params_stat
+        if params_changed or self.find_pairs(self.params) != self.pairs:
+            return {'type': 'spec', 'spec': self.build()}
+        changed = {}
+        for path, stat in list(self.stats.items()):
+            new_stat = _stat(path)
+            if new_stat == stat:
+                continue
+            try:
+                datasets = self.panel_datasets(path)
+            except Exception as error:  # e.g. while the workbook is being saved, it is read again at the next poll
+                print(f'preview: {path}: {error}', file=sys.stderr)
+                continue
+            with self._lock:
+                self.stats[path] = new_stat
+                self.spec['datasets'].update(datasets)
+            changed.update(datasets)
+        if changed:
+            return {'type': 'data', 'datasets': changed}
+        return None
+
+    def subscribe(self):
+        # message queue (of JSON texts) of a new page, it starts with the current spec
+        messages = queue.Queue()
+        with self._lock:
+            messages.put(json.dumps({'type': 'spec', 'spec': self.spec}))
+            self._clients.append(messages)
+        return messages
+
+    def unsubscribe(self, messages):
+        with self._lock:
+            self._clients.remove(messages)
+
+    def publish(self, message):
+        text = json.dumps(message)  # once for all pages
+        with self._lock:
+            for messages in self._clients:
+                messages.put(text)
+
+    def watch(self, interval=0.5):
+        """
+        Poll the files every `interval` seconds and send the changes to the open pages (runs forever).
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                message = self.poll()
+            except Exception as error:  # keep the preview running, e.g. a broken parameter file
+                print(f'preview: {error}', file=sys.stderr)
+                continue
+            if message is not None:
+                self.publish(message)
+
+
+def make_handler(preview):
+    """
+    Request handler class for a Preview: / is the page, /events the server-sent events.
+    """
+    page = PAGE.format(vega=alt.VEGA_VERSION, vegalite=alt.VEGALITE_VERSION,
+                       vegaembed=alt.VEGAEMBED_VERSION).encode('utf-8')
+
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/':
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+            elif self.path == '/events':
+                self.send_events()
+            else:
+                self.send_error(404)
+
+        def send_events(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            messages = preview.subscribe()
+            try:
+                while True:
+                    try:
+                        self.wfile.write(f'data: {messages.get(timeout=15)}\n\n'.encode('utf-8'))
+                    except queue.Empty:
+                        self.wfile.write(b': keep-alive\n\n')  # also notices closed pages
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the page was closed
+            finally:
+                preview.unsubscribe(messages)
+
+        def log_message(self, format, *args):
+            pass  # no line for every request
+
+    return PreviewHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Live preview of the combined figure, '
+                                                 'updated when a workbook or the parameters change.')
+    parser.add_argument('data_dir', help='folder with the c_share_* and sel_cur_* workbooks')
+    parser.add_argument('--params', help='JSON file with the chart parameters (watched as well)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='also search the sub folders')
+    parser.add_argument('--port', type=int, default=8050, help='port of the preview (default: 8050)')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between the file checks')
+    parser.add_argument('--workers', type=int, default=1, help='panels loaded at the same time (default: 1)')
+    parser.add_argument('--open', action='store_true', help='open the preview in the web browser')
+    args = parser.parse_args(argv)
+
+    preview = Preview(args.data_dir, args.params, args.recursive, args.workers)
+    if not preview.pairs:
+        print(f'no c_share_*/sel_cur_* workbook pairs found in {args.data_dir}', file=sys.stderr)
+        return 1
+    threading.Thread(target=preview.watch, args=(args.interval,), daemon=True).start()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(preview))
+    server.daemon_threads = True  # open event streams do not block the shutdown
+    url = f'http://127.0.0.1:{server.server_port}/'
+    print(f'preview of {len(preview.pairs)} rows at {url} (Ctrl+C to stop)')
+    if args.open:
+        webbrowser.open(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
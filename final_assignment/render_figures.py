@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Batch renderer for the catch share and selection curve figures.
+
+Finds every c_share_*_MB*_*.xlsx / sel_cur_*_MB*_*.xlsx pair under a folder (of the species
+the figure 8 axes are set for, plot_files.FIGURE8_SPECIES) and
+saves one html figure per pair (catch share chart left, selection curve chart right,
+the same row layout as figure 8) into an output folder. Nothing is opened in a
+browser, so it runs headless on the render nodes. Besides html the figures can be
+exported as svg, png or pdf (see static_export.py), the renderer is started once per batch.
+
+The pairs are streamed: each figure is loaded, built, saved and released before
+the next one is started, so memory stays flat for any number of workbooks.
+With --faceted one figure per species and year is saved instead, with all meshes drawn
+from the long format table of tidy_store.py.
+The curve metrics (L50, SR, catch share extrema, see curve_summary.py) of every pair are
+written to curve_summary.sqlite in the output folder.
+
+Usage:
+    python render_figures.py data -o figures
+    python render_figures.py plot_data -o figures --recursive --simplify
+    python render_figures.py data -o figures --incremental   (skip figures whose inputs did not change)
+    python render_figures.py data -o figures --format svg --format pdf
+    python render_figures.py data -o figures --trace trace.json --profile-dir profiles
+    python render_figures.py data -o figures --faceted --simplify
+    python render_figures.py data -o figures --workers 2 --processes
+"""
+
+import argparse   # argparse for the command line options
+import os         # os for the output paths
+import sys        # sys for the exit code
+
+import altair as alt  # altair for the single chart figures
+from exam_script_fig8 import CHART_MODULES, generate_chart1, generate_chart2, generate_combined_spec  # figure 8 charts
+from plot_files import FIGURE8_SPECIES, find_plot_files  # finds and pairs the workbooks
+from build_manifest import build_hash, is_current, record_build  # incremental builds
+from static_export import OUTPUT_FORMATS, STATIC_FORMATS, save_chart, warm_up  # html/svg/png/pdf output
+from stage_trace import start_trace, stop_trace  # optional stage timings and profiles
+from tidy_store import FACET_MODULES, faceted_chart, load_tidy  # faceted figures from the long format table
+from curve_summary import SUMMARY_NAME, pair_metrics, write_summary  # metrics index next to the figures
+
+
+def render_pair(catch_share_path, sel_cur_path, chart_files, simplify=False, workers=1, use_processes=False):
+    """
+    Build the figure for one catch share / selection curve pair and save it to each of
+    chart_files (the format is taken from the extension: html, svg, png or pdf).
+    If one of the two workbooks is missing (None) the other chart is saved on its own.
+    workers, use_processes: load the two panels at the same time (see generate_combined_spec)
+    """
+    if catch_share_path is not None and sel_cur_path is not None:
+        # one row of figure 8, from the compiled chart templates
+        chart = generate_combined_spec([catch_share_path], [sel_cur_path], simplify, title_font_size=30,
+                                       workers=workers, use_processes=use_processes)
+    elif catch_share_path is not None:
+        chart = alt.hconcat(generate_chart1(catch_share_path, simplify))
+    else:
+        chart = alt.hconcat(generate_chart2(sel_cur_path, simplify))
+    if not isinstance(chart, dict):
+        chart = chart.configure_view(stroke=None).configure_title(fontSize=30)  # same look as figure 8
+    for chart_file in chart_files:
+        save_chart(chart, chart_file)
+    return chart_files
+
+
+def iter_render(data_dir, out_dir, recursive=False, simplify=False, incremental=False, formats=('html',),
+                workers=1, use_processes=False):
+    """
+    Render every pair found in data_dir into out_dir, one figure at a time.
+    Yields (output file, built) for each pair and format, the files are named
+    <species>_<mesh>_<year>.<format>. Only the species in FIGURE8_SPECIES are drawn,
+    the chart axes are set for them (see plot_files.py).
+    With incremental=True a figure is skipped (built is False) when its workbooks, the chart
+    code and the library versions are the same as in the last build (see build_manifest.py).
+    workers, use_processes: passed to render_pair
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    chart_modules = (sys.modules[__name__],) + CHART_MODULES
+    renderer_started = False
+    for species, mesh, year, catch_share_path, sel_cur_path in find_plot_files(data_dir, recursive, FIGURE8_SPECIES):
+        # metrics index, also for skipped figures (the workbooks come from the cache)
+        write_summary(os.path.join(out_dir, SUMMARY_NAME), species, mesh, year,
+                      pair_metrics(catch_share_path, sel_cur_path))
+        chart_files = [os.path.join(out_dir, f'{species}_{mesh}_{year}.{output_format}') for output_format in formats]
+        figure_hash = build_hash([catch_share_path, sel_cur_path], chart_modules, {'simplify': simplify})
+        if incremental and all(is_current(chart_file, figure_hash) for chart_file in chart_files):
+            for chart_file in chart_files:
+                yield chart_file, False
+            continue
+        if not renderer_started and set(formats) & set(STATIC_FORMATS):
+            warm_up()  # one renderer for the whole batch, started when the first static figure is needed
+            renderer_started = True
+        render_pair(catch_share_path, sel_cur_path, chart_files, simplify, workers, use_processes)
+        for chart_file in chart_files:
+            record_build(chart_file, figure_hash)
+            yield chart_file, True
+
+
+def iter_render_faceted(data_dir, out_dir, recursive=False, simplify=False, incremental=False, formats=('html',)):
+    """
+    Render one faceted figure per species and year (all meshes, see tidy_store.py) into out_dir.
+    Yields (output file, built) like iter_render, the files are named <species>_<year>.<format>.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    groups = {}
+    for species, mesh, year, catch_share_path, sel_cur_path in find_plot_files(data_dir, recursive, FIGURE8_SPECIES):
+        groups.setdefault((species, year), []).extend(path for path in (catch_share_path, sel_cur_path) if path)
+        write_summary(os.path.join(out_dir, SUMMARY_NAME), species, mesh, year,
+                      pair_metrics(catch_share_path, sel_cur_path))
+    tidy = None
+    renderer_started = False
+    for (species, year), paths in groups.items():
+        chart_files = [os.path.join(out_dir, f'{species}_{year}.{output_format}') for output_format in formats]
+        figure_hash = build_hash(paths, (sys.modules[__name__],) + FACET_MODULES, {'simplify': simplify})
+        if incremental and all(is_current(chart_file, figure_hash) for chart_file in chart_files):
+            for chart_file in chart_files:
+                yield chart_file, False
+            continue
+        if tidy is None:  # all workbooks in one table, read once when the first figure is built
+            tidy = load_tidy(data_dir, recursive, simplify)
+        if not renderer_started and set(formats) & set(STATIC_FORMATS):
+            warm_up()
+            renderer_started = True
+        figure = faceted_chart(tidy[(tidy['species'] == species) & (tidy['year'] == year)],
+                               title=species.capitalize())
+        for chart_file in chart_files:
+            save_chart(figure, chart_file)
+            record_build(chart_file, figure_hash)
+            yield chart_file, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render catch share and selection curve figures '
+                                                 'for all workbook pairs in a folder.')
+    parser.add_argument('data_dir', help='folder with the c_share_* and sel_cur_* workbooks')
+    parser.add_argument('-o', '--out-dir', default='figures', help='folder for the figures (default: figures)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='also search the sub folders')
+    parser.add_argument('--simplify', action='store_true', help='downsample the modelled curves (see curve_simplify.py)')
+    parser.add_argument('--incremental', action='store_true', help='only rebuild figures whose inputs changed')
+    parser.add_argument('--format', dest='formats', action='append', choices=OUTPUT_FORMATS,
+                        help='output format, can be given more than once (default: html)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='panels loaded at the same time (default: 1, one after another)')
+    parser.add_argument('--processes', action='store_true',
+                        help='with --workers: a process pool instead of threads (faster when the cache is cold)')
+    parser.add_argument('--faceted', action='store_true',
+                        help='one faceted figure per species and year with all meshes (see tidy_store.py)')
+    parser.add_argument('--trace', help='JSON file for the per file and per stage timings')
+    parser.add_argument('--profile-dir', help='with --trace: folder for one cProfile file per workbook')
+    parser.add_argument('--trace-memory', action='store_true', help='with --trace: peak memory of every workbook')
+    args = parser.parse_args(argv)
+
+    # workbooks of species the figure 8 axes are not set for are left out, with a note
+    skipped = sorted({files[0] for files in find_plot_files(args.data_dir, args.recursive)} - set(FIGURE8_SPECIES))
+    if skipped:
+        print(f'skipped the {", ".join(skipped)} workbooks, the figures are only drawn for '
+              f'{", ".join(FIGURE8_SPECIES)} (see plot_files.FIGURE8_SPECIES)', file=sys.stderr)
+    if args.trace:
+        start_trace(args.profile_dir, args.trace_memory)
+    count = 0
+    if args.faceted:  # one table for all meshes, there are no separate panels to load in a pool
+        renders = iter_render_faceted(args.data_dir, args.out_dir, args.recursive, args.simplify,
+                                      args.incremental, args.formats or ['html'])
+    else:
+        renders = iter_render(args.data_dir, args.out_dir, args.recursive, args.simplify,
+                              args.incremental, args.formats or ['html'], args.workers, args.processes)
+    for chart_file, built in renders:
+        print(chart_file if built else f'{chart_file} (up to date)')
+        count += 1
+    if args.trace:
+        stop_trace(args.trace)
+    if count == 0:
+        print(f'no c_share_*/sel_cur_* workbooks found in {args.data_dir}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
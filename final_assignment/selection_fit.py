@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Fitting selection curves and catch share curves from raw length frequency counts.
+
+Until now the curves were fitted in external statistical software and exported to the
+c_share_*/sel_cur_* workbooks. This module fits them directly, so every mesh can be refitted
+within the plotting run, and returns frames with the same X/Y columns the chart functions use.
+
+Raw data is a long table with one row per haul and length class:
+    haul, length, retained, escaped   (covered codend / trouser trawl, for selection curves)
+    haul, length, test, control       (paired gear, for catch share curves)
+Counts are summed over hauls for the fit.
+
+Models (same parameterisation as SELNET):
+    logistic: r(l) = 1 / (1 + exp(-ln(9) / SR * (l - L50)))
+    richards: r(l) = (exp(A) / (1 + exp(A)))^(1/delta),
+              A = a50 + (l - L50) / SR * (a75 - a25), aX = ln(X^delta / (1 - X^delta))
+    catch share (paired gear) with split parameter p: cs(l) = p r(l) / (p r(l) + 1 - p)
+
+The likelihoods are binomial and computed for all length classes at once with numpy,
+scipy.optimize does the maximisation. The 95% bands are from the delta method with the
+numerical Hessian of the likelihood, bootstrap.py gives double bootstrap bands instead.
+"""
+
+import numpy as np                 # numpy for the vectorized likelihoods
+import pandas as pd                # pandas for the raw data and output frames
+from scipy import optimize         # scipy for the maximum likelihood fit
+from scipy.special import expit    # expit = 1 / (1 + exp(-x)), numerically stable
+
+MODELS = ('logistic', 'richards')
+LN9 = np.log(9.0)
+_EPS = 1e-12  # keeps log() away from 0
+
+
+def retention(length, L50, SR, delta=1.0, model='logistic'):
+    """
+    Retention probability r(l) for an array of lengths.
+    L50, SR and delta may also be arrays of the same length as a leading axis
+    (shape (n, 1)), which gives one curve per row.
+    """
+    length = np.asarray(length, dtype=float)
+    if model == 'logistic':
+        return expit(LN9 / SR * (length - L50))
+    if model == 'richards':
+        def a(x):  # ln(x^delta / (1 - x^delta))
+            return np.log(x ** delta / (1.0 - x ** delta))
+        A = a(0.5) + (length - L50) / SR * (a(0.75) - a(0.25))
+        return expit(A) ** (1.0 / delta)
+    raise ValueError(f'unknown model {model!r}, use one of {MODELS}')
+
+
+def catch_share(length, L50, SR, p, delta=1.0, model='logistic'):
+    """
+    Catch share of the test gear, cs(l) = p r(l) / (p r(l) + 1 - p).
+    p is the split parameter (share of the fish entering the test gear).
+    """
+    r = p * retention(length, L50, SR, delta, model)
+    return r / (r + 1.0 - p)
+
+
+def length_totals(raw, columns):
+    """
+    Sum the raw counts over hauls: returns the sorted length classes
+    and one count array per column.
+    """
+    totals = raw.groupby('length', sort=True)[list(columns)].sum()
+    return totals.index.to_numpy(dtype=float), [totals[column].to_numpy(dtype=float) for column in columns]
+
+
+def _unpack(theta, model, paired):
+    # the optimizer works on unbounded values: SR, delta > 0 via log, 0 < p < 1 via logit
+    L50, SR = theta[0], np.exp(theta[1])
+    position = 2
+    delta = 1.0
+    if model == 'richards':
+        delta = np.exp(theta[position])
+        position += 1
+    p = expit(theta[position]) if paired else None
+    return L50, SR, delta, p
+
+
+def model_curve(theta, length, model, paired):
+    """
+    Selection or catch share curve for the unbounded parameters theta (as in fit['theta']).
+    theta may also have shape (n parameters, n curves, 1), then one curve per row is returned.
+    """
+    L50, SR, delta, p = _unpack(theta, model, paired)
+    if paired:
+        return catch_share(length, L50, SR, p, delta, model)
+    return retention(length, L50, SR, delta, model)
+
+
+def _neg_log_likelihood(theta, length, successes, failures, model, paired):
+    # binomial likelihood over all length classes at once
+    prob = np.clip(model_curve(theta, length, model, paired), _EPS, 1.0 - _EPS)
+    return -np.sum(successes * np.log(prob) + failures * np.log1p(-prob))
+
+
+def _start_values(length, successes, failures, model, paired):
+    total = successes + failures
+    share = np.divide(successes, total, out=np.full_like(successes, np.nan), where=total > 0)
+    if paired:
+        p = np.clip(successes.sum() / total.sum(), 0.05, 0.95)
+        share = share / np.nanmax(share)  # relative retention, the plateau is p
+    else:
+        p = None
+    # L50 start: first length where the observed share passes 0.5, SR: a quarter of the length range
+    above = np.flatnonzero(share >= 0.5)
+    L50 = length[above[0]] if above.size else np.average(length, weights=np.maximum(total, _EPS))
+    theta = [L50, np.log(max((length.max() - length.min()) / 4.0, 1.0))]
+    if model == 'richards':
+        theta.append(0.0)  # delta = 1 is the logistic curve
+    if paired:
+        theta.append(np.log(p / (1.0 - p)))
+    return np.array(theta, dtype=float)
+
+
+def _numerical_hessian(function, theta, step=1e-4):
+    # central differences, the likelihood is smooth so this is accurate enough for the bands
+    n = len(theta)
+    hessian = np.empty((n, n))
+    steps = step * np.maximum(np.abs(theta), 1.0)
+    for i in range(n):
+        for j in range(i, n):
+            ei = np.zeros(n)
+            ej = np.zeros(n)
+            ei[i] = steps[i]
+            ej[j] = steps[j]
+            value = (function(theta + ei + ej) - function(theta + ei - ej)
+                     - function(theta - ei + ej) + function(theta - ei - ej)) / (4.0 * steps[i] * steps[j])
+            hessian[i, j] = hessian[j, i] = value
+    return hessian
+
+
+def fit_counts(length, successes, failures, model='logistic', paired=False, start=None, covariance=True):
+    """
+    Fit a selection (paired=False) or catch share (paired=True) model to summed counts.
+
+    length: length classes
+    successes, failures: retained/escaped counts, or test/control counts for paired gear
+    start: optional start values (unbounded parameters, as returned in 'theta')
+    covariance: if False the Hessian is not computed (faster, e.g. for bootstrap replicates)
+
+    Returns a dict with L50, SR, delta, p (None for selection models), theta,
+    covariance (of theta, from the numerical Hessian, None if it is not invertible),
+    deviance (neg. log likelihood * 2), model and paired.
+    """
+    if model not in MODELS:
+        raise ValueError(f'unknown model {model!r}, use one of {MODELS}')
+    length = np.asarray(length, dtype=float)
+    successes = np.asarray(successes, dtype=float)
+    failures = np.asarray(failures, dtype=float)
+    if start is None:
+        start = _start_values(length, successes, failures, model, paired)
+
+    def objective(theta):
+        return _neg_log_likelihood(theta, length, successes, failures, model, paired)
+
+    result = optimize.minimize(objective, start, method='Nelder-Mead',
+                               options={'xatol': 1e-8, 'fatol': 1e-10, 'maxiter': 20000})
+    if covariance:
+        try:
+            covariance = np.linalg.inv(_numerical_hessian(objective, result.x))
+        except np.linalg.LinAlgError:
+            covariance = None
+    else:
+        covariance = None
+    L50, SR, delta, p = _unpack(result.x, model, paired)
+    return {
+        'L50': float(L50), 'SR': float(SR), 'delta': float(delta),
+        'p': None if p is None else float(p),
+        'theta': result.x, 'covariance': covariance,
+        'deviance': 2.0 * float(result.fun), 'converged': bool(result.success),
+        'model': model, 'paired': paired,
+    }
+
+
+def fit_selection(raw, model='logistic'):
+    """
+    Fit a selection curve to raw covered codend / trouser counts (columns length, retained, escaped).
+    """
+    length, (retained, escaped) = length_totals(raw, ['retained', 'escaped'])
+    return fit_counts(length, retained, escaped, model=model, paired=False)
+
+
+def fit_catch_share(raw, model='logistic'):
+    """
+    Fit a catch share curve to raw paired gear counts (columns length, test, control).
+    """
+    length, (test, control) = length_totals(raw, ['test', 'control'])
+    return fit_counts(length, test, control, model=model, paired=True)
+
+
+def curve_grid(length, step=0.1):
+    """
+    Length grid for the modelled curves, from the smallest to the largest length class.
+    """
+    return np.round(np.arange(np.min(length), np.max(length) + step / 2, step), 10)
+
+
+def delta_method_band(fit, grid, level=1.96):
+    """
+    Lower and upper limits of the curve from the delta method:
+    curve +- level * sqrt(g' C g), g = gradient of the curve to theta (numerical), C = covariance.
+    """
+    theta = fit['theta']
+    curve = model_curve(theta, grid, fit['model'], fit['paired'])
+    if fit['covariance'] is None:
+        return np.full_like(curve, np.nan), np.full_like(curve, np.nan)
+    gradient = np.empty((len(theta), len(grid)))
+    for i in range(len(theta)):
+        step = 1e-6 * max(abs(theta[i]), 1.0)
+        shift = np.zeros(len(theta))
+        shift[i] = step
+        gradient[i] = (model_curve(theta + shift, grid, fit['model'], fit['paired'])
+                       - model_curve(theta - shift, grid, fit['model'], fit['paired'])) / (2.0 * step)
+    spread = level * np.sqrt(np.maximum(np.einsum('il,ij,jl->l', gradient, fit['covariance'], gradient), 0.0))
+    return np.clip(curve - spread, 0.0, 1.0), np.clip(curve + spread, 0.0, 1.0)
+
+
+def _columns(columns):
+    # ragged columns padded with NaN, like the statistical software export
+    return pd.concat({name: pd.Series(np.asarray(values, dtype=float)) for name, values in columns.items()}, axis=1)
+
+
+def selection_curve_frame(fit, grid, lower=None, upper=None):
+    """
+    Frame for generate_chart2: X0/Y0 curve, X1/Y1 lower and X2/Y2 upper 95% limit.
+    Without lower/upper the delta method band is used.
+    """
+    curve = model_curve(fit['theta'], grid, fit['model'], fit['paired'])
+    if lower is None or upper is None:
+        lower, upper = delta_method_band(fit, grid)
+    return _columns({'X0': grid, 'Y0': curve, 'X1': grid, 'Y1': lower, 'X2': grid, 'Y2': upper})
+
+
+def catch_share_frame(fit, raw, grid):
+    """
+    Frame for generate_chart1: X0/Y0 observed catch share, X1/Y1 modelled curve,
+    X2/Y2 control counts and X3/Y3 test counts per length class.
+    """
+    length, (test, control) = length_totals(raw, ['test', 'control'])
+    total = test + control
+    observed = np.divide(test, total, out=np.full_like(test, np.nan), where=total > 0)
+    curve = model_curve(fit['theta'], grid, fit['model'], fit['paired'])
+    return _columns({'X0': length, 'Y0': observed, 'X1': grid, 'Y1': curve,
+                     'X2': length, 'Y2': control, 'X3': length, 'Y3': test})
+
+
+def fit_selection_frame(raw, model='logistic', step=0.1):
+    """
+    Fit raw covered codend counts and return (fit, frame for generate_chart2).
+    """
+    fit = fit_selection(raw, model)
+    grid = curve_grid(raw['length'], step)
+    return fit, selection_curve_frame(fit, grid)
+
+
+def fit_catch_share_frame(raw, model='logistic', step=0.1):
+    """
+    Fit raw paired gear counts and return (fit, frame for generate_chart1).
+    """
+    fit = fit_catch_share(raw, model)
+    grid = curve_grid(raw['length'], step)
+    return fit, catch_share_frame(fit, raw, grid)
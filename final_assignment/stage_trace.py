@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of the chart pipeline, per file and per stage.
+
+Nothing is recorded until start_trace() is called, the stage() blocks in the chart
+functions are then timed and every finished stage becomes one record like
+    {"file": "c_share_krill_MB14_22.xlsx", "stage": "read_excel", "seconds": 0.21, "rows": 4000}
+with extra fields where they are known: rows, nan_coerced (cells that were not empty but
+could not be converted to numbers), bytes (size of a saved figure).
+The records are logged as JSON on the 'chart_trace' logger (level DEBUG) and written
+to a JSON trace file by stop_trace().
+
+Per panel (one workbook) a cProfile file and the tracemalloc peak can also be captured.
+tracemalloc runs from start_trace() to stop_trace(), so panels built in threads do not stop it
+for each other, but its peak is process wide: the peak_bytes of panels built at the same time
+include each other. Only one cProfile profiler can be active in a process (python 3.12+ profiles
+through sys.monitoring), so only one panel at a time is profiled: panels built in threads while
+another panel is profiled get no profile file ("profile": null). Use these captures with sequential
+builds for exact numbers and a profile of every panel. Work done in the worker processes of generate_combined_chart /
+generate_combined_spec(use_processes=True) is not traced.
+
+    start_trace(profile_dir='profiles', memory=True)
+    ... build and save figures ...
+    stop_trace('trace.json')
+"""
+
+import cProfile     # cProfile for the optional per panel profiles
+import json         # json for the log records and the trace file
+import logging      # logging for the structured log records
+import os           # os for file names
+import threading    # threading for the lock (panels can be built in threads)
+import time         # time for the stage timings
+import tracemalloc  # tracemalloc for the optional per panel memory peak
+from contextlib import contextmanager
+
+logger = logging.getLogger('chart_trace')
+
+_trace = None  # the active trace, None when tracing is off
+_lock = threading.Lock()
+_profile_lock = threading.Lock()  # held by the panel that is profiled
+
+
+def start_trace(profile_dir=None, memory=False):
+    """
+    Start recording stage timings.
+    profile_dir: folder for one cProfile file per panel (<workbook name>.prof), None for no profiles
+    memory: also record the tracemalloc peak of every panel (tracemalloc is started here, unless
+    it is already running, and stopped again by stop_trace)
+    """
+    global _trace
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    started_memory = memory and not tracemalloc.is_tracing()
+    if started_memory:
+        tracemalloc.start()
+    _trace = {'records': [], 'profile_dir': profile_dir, 'memory': memory, 'started_memory': started_memory,
+              'active_panels': 0}  # panels measured at the moment, the peak is only reset when there are none
+
+
+def stop_trace(json_path=None):
+    """
+    Stop recording, write the records to json_path (if given) and return them.
+    """
+    global _trace
+    trace, _trace = _trace, None
+    if trace and trace['started_memory']:
+        tracemalloc.stop()
+    records = trace['records'] if trace else []
+    if json_path is not None:
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(records, file, indent=1)
+    return records
+
+
+def is_tracing():
+    return _trace is not None
+
+
+def _add(record):
+    with _lock:
+        if _trace is not None:
+            _trace['records'].append(record)
+    logger.debug(json.dumps(record))
+
+
+@contextmanager
+def stage(name, file=None, **fields):
+    """
+    Time a stage of the pipeline. The yielded dict can be filled with more fields
+    (rows, nan_coerced, bytes, ...) inside the block. Without an active trace
+    the block just runs and the dict is thrown away.
+    """
+    record = {'file': os.path.basename(file) if file else None, 'stage': name}
+    record.update(fields)
+    if _trace is None:
+        yield record
+        return
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        _add(record)
+
+
+@contextmanager
+def panel(file):
+    """
+    Stage around all the work for one workbook, with the optional cProfile / tracemalloc capture.
+    Only one panel at a time is profiled (see the top of this file), a panel that starts while
+    another one is profiled gets "profile": null.
+    """
+    trace = _trace
+    if trace is None:
+        yield None
+        return
+    profile_dir, memory = trace['profile_dir'], trace['memory']
+    if memory:
+        with _lock:
+            if trace['active_panels'] == 0:  # a reset while other panels run would lose their peak
+                tracemalloc.reset_peak()
+            trace['active_panels'] += 1
+        start_bytes = tracemalloc.get_traced_memory()[0]
+    profiling = profile_dir is not None and _profile_lock.acquire(blocking=False)
+    profiler = None
+    try:
+        with stage('panel', file) as record:
+            try:
+                if profiling:
+                    profiler = cProfile.Profile()
+                    try:
+                        profiler.enable()
+                    except ValueError:  # another profiling tool is active in the process (python 3.12+)
+                        profiler = None
+                yield record
+            finally:
+                if profiler:
+                    profiler.disable()
+                    profile_file = os.path.join(profile_dir, os.path.basename(file) + '.prof')
+                    profiler.dump_stats(profile_file)
+                    record['profile'] = profile_file
+                elif profile_dir is not None:
+                    record['profile'] = None  # another panel was profiled at the same time
+                if memory:
+                    record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - start_bytes
+    finally:
+        if profiling:
+            _profile_lock.release()
+        if memory:
+            with _lock:
+                trace['active_panels'] -= 1
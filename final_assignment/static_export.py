@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Static export (SVG/PNG/PDF) of the charts without a browser.
+
+The figures are rendered offline with vl-convert (pip install vl-convert-python).
+vl-convert runs the Vega-Lite/Vega JavaScript in an embedded engine, starting that engine
+is the slow part of the first export, later exports in the same process reuse it.
+warm_up() starts it once at the beginning of a batch, save_chart() then only pays for the
+rendering of each figure. For a batch in a process pool every worker keeps its own engine.
+"""
+
+import os   # os for the file extension
+
+import altair as alt  # altair for the html output and the vega-lite version
+from chart_templates import spec_html  # html for spec dicts from the compiled templates
+from stage_trace import stage  # optional stage timings
+
+STATIC_FORMATS = ('svg', 'png', 'pdf')
+OUTPUT_FORMATS = ('html',) + STATIC_FORMATS
+
+# vega-lite version of the specs altair writes, e.g. 'v6.1'
+VL_VERSION = '.'.join(alt.SCHEMA_VERSION.split('.')[:2])
+
+# tiny spec for starting the renderer before the first real figure
+_WARM_UP_SPEC = {'data': {'values': [{'x': 0}]}, 'mark': 'point', 'encoding': {'x': {'field': 'x', 'type': 'quantitative'}}}
+
+
+def _vl_convert():
+    try:
+        import vl_convert
+    except ImportError:
+        raise ImportError('static export needs vl-convert: pip install vl-convert-python') from None
+    return vl_convert
+
+
+def warm_up():
+    """
+    Start the renderer once, so the first figure of a batch is not slower than the others.
+    """
+    _vl_convert().vegalite_to_svg(_WARM_UP_SPEC, vl_version=VL_VERSION)
+
+
+def save_chart(chart, chart_file, scale=2):
+    """
+    Save a chart as html, svg, png or pdf, the format is taken from the file extension.
+    chart can also be a spec dict (e.g. from generate_combined_spec).
+    scale: resolution factor for png (2 gives 800x500 pixels for a 400x250 chart).
+    """
+    with stage('save', chart_file) as record:
+        _save_chart(chart, chart_file, scale)
+        record['bytes'] = os.path.getsize(chart_file)
+    return chart_file
+
+
+def _save_chart(chart, chart_file, scale):
+    output_format = os.path.splitext(chart_file)[1].lstrip('.').lower()
+    if output_format == 'html':
+        if isinstance(chart, dict):
+            with open(chart_file, 'w', encoding='utf-8') as file:
+                file.write(spec_html(chart))
+        else:
+            chart.save(chart_file)
+        return chart_file
+    if output_format not in STATIC_FORMATS:
+        raise ValueError(f'unknown output format {output_format!r}, use one of {OUTPUT_FORMATS}')
+
+    vl_convert = _vl_convert()
+    spec = chart if isinstance(chart, dict) else chart.to_dict()
+    if output_format == 'svg':
+        content = vl_convert.vegalite_to_svg(spec, vl_version=VL_VERSION).encode('utf-8')
+    elif output_format == 'png':
+        content = vl_convert.vegalite_to_png(spec, vl_version=VL_VERSION, scale=scale)
+    else:
+        content = vl_convert.vegalite_to_pdf(spec, vl_version=VL_VERSION)
+    with open(chart_file, 'wb') as file:
+        file.write(content)
+    return chart_file
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+All plot workbooks of a folder in one long format (tidy) table, and a faceted figure from it.
+
+Every workbook has its own X/Y column pairs (X0/Y0, X1/Y1, ...), one pair per layer of the
+chart. load_tidy() reads all c_share_* and sel_cur_* workbooks (through the cache of
+data_cache.py) and stacks the pairs into one table:
+
+    species  mesh  year  series             length  value
+    krill    MB14  22    catch_share_curve  15.0    0.43
+    krill    MB14  22    main_curve         15.0    0.02
+    ...
+
+species, mesh, year and series are categorical, so the repeated labels are stored once.
+faceted_chart() draws every mesh of a species and year from this one table: one faceted
+catch share chart and one faceted selection curve chart, instead of one chart object (with
+its own copy of the data) for every workbook as in generate_combined_chart.
+
+    tidy = load_tidy('data', simplify=True)
+    save_chart(faceted_chart(tidy, title='Krill'), 'figure8_faceted.html')
+"""
+
+import sys  # sys for this module in FACET_MODULES
+
+import altair as alt  # altair for the faceted chart
+import pandas as pd   # pandas for the long format table
+
+import chart_templates, curve_simplify, data_cache, plot_files, static_export  # modules hashed for --incremental
+
+from curve_simplify import simplify_line  # optional curve downsampling
+from data_cache import load_plot_data, layer_data  # cached excel loader, per layer data
+from plot_files import FIGURE8_SPECIES, find_plot_files  # finding and pairing the workbooks
+
+# series name -> (X column, Y column) of the workbooks, see generate_chart1 / generate_chart2
+CATCH_SHARE_SERIES = {
+    'catch_points': ('X0', 'Y0'),
+    'catch_share_curve': ('X1', 'Y1'),
+    'control_population': ('X2', 'Y2'),
+    'test_population': ('X3', 'Y3'),
+}
+SEL_CUR_SERIES = {
+    'main_curve': ('X0', 'Y0'),
+    'lower_limit': ('X1', 'Y1'),
+    'upper_limit': ('X2', 'Y2'),
+}
+SERIES = tuple(CATCH_SHARE_SERIES) + tuple(SEL_CUR_SERIES)
+TIDY_COLUMNS = ('species', 'mesh', 'year', 'series', 'length', 'value')
+
+# modelled curves that simplify=True downsamples (the same as in exam_script_fig8.py)
+SIMPLIFY_SERIES = ('catch_share_curve', 'main_curve', 'lower_limit', 'upper_limit')
+
+
+def tidy_frame(data, series_columns, species, mesh, year, simplify=False):
+    """
+    Long format rows of one workbook.
+    data: the workbook data (X0, Y0, ... columns)
+    series_columns: CATCH_SHARE_SERIES or SEL_CUR_SERIES
+    """
+    parts = []
+    for series, (x, y) in series_columns.items():
+        layer = layer_data(data, [x, y])
+        if simplify and series in SIMPLIFY_SERIES:
+            layer = simplify_line(layer, x, y, [15, 55], [0, 1.01], width=400, height=250)
+        parts.append(pd.DataFrame({'series': series, 'length': layer[x].to_numpy(), 'value': layer[y].to_numpy()}))
+    frame = pd.concat(parts, ignore_index=True)
+    frame.insert(0, 'year', year)
+    frame.insert(0, 'mesh', mesh)
+    frame.insert(0, 'species', species)
+    return frame
+
+
+def as_tidy(frame):
+    """
+    Set the categorical dtypes of a long format table. The meshes are ordered by
+    mesh size (MB14 before MB100), the series in the order of SERIES.
+    """
+    frame = frame.reset_index(drop=True)
+    meshes = sorted(frame['mesh'].unique(), key=lambda mesh: int(mesh[2:]))
+    frame['species'] = pd.Categorical(frame['species'], categories=list(dict.fromkeys(frame['species'])))
+    frame['mesh'] = pd.Categorical(frame['mesh'], categories=meshes, ordered=True)
+    frame['year'] = pd.Categorical(frame['year'], categories=list(dict.fromkeys(frame['year'])))
+    frame['series'] = pd.Categorical(frame['series'], categories=list(SERIES))
+    return frame[list(TIDY_COLUMNS)]
+
+
+def load_tidy(data_dir, recursive=False, simplify=False, species=FIGURE8_SPECIES):
+    """
+    Read all plot workbooks under data_dir into one long format table
+    (columns TIDY_COLUMNS, see the top of this file).
+    simplify: downsample the modelled curves to the points visible at 400x250 (curve_simplify.py)
+    species: only these species (default FIGURE8_SPECIES, the axes of the faceted charts are
+    set for them), None for all
+    """
+    frames = []
+    for file_species, mesh, year, catch_share_path, sel_cur_path in find_plot_files(data_dir, recursive, species):
+        for path, series_columns in ((catch_share_path, CATCH_SHARE_SERIES), (sel_cur_path, SEL_CUR_SERIES)):
+            if path is not None:
+                frames.append(tidy_frame(load_plot_data(path), series_columns, file_species, mesh, year, simplify))
+    if not frames:
+        raise ValueError(f'no c_share_* or sel_cur_* workbooks in {data_dir}')
+    return as_tidy(pd.concat(frames, ignore_index=True))
+
+
+def chart_values(tidy):
+    """
+    The table as Vega-Lite data values with one record per mesh and series, the lengths and
+    values as arrays: {"mesh": "MB14", "series": "main_curve", "length": [...], "value": [...]}.
+    The labels are then written once per series instead of once per row, the charts turn the
+    arrays back into rows with a flatten transform. Missing values (NaN) become null.
+    """
+    values = []
+    for (mesh, series), group in tidy.groupby(['mesh', 'series'], observed=True, sort=True):
+        columns = group[['length', 'value']].astype(object)
+        columns = columns.where(group[['length', 'value']].notna(), None)
+        values.append({'mesh': mesh, 'series': series,
+                       'length': columns['length'].tolist(), 'value': columns['value'].tolist()})
+    return values
+
+
+def _series(chart, name):
+    # one series of the table as rows (length, value)
+    return chart.transform_filter(alt.datum.series == name).transform_flatten(['length', 'value'])
+
+
+def _axis_x():
+    return alt.X('length:Q', scale=alt.Scale(domain=[15, 55]), title='Length (mm)',
+                 axis=alt.Axis(values=[15, 25, 35, 45, 55], grid=False, titleFontSize=30, labelFontSize=25,
+                               titlePadding=20))
+
+
+def catch_share_facet_layers():
+    # the layers of build_chart1, every layer is one series of the table
+    curve = _series(alt.Chart().mark_line(color='black', clip=True, size=5).encode(
+        x=_axis_x(),
+        y=alt.Y('value:Q', scale=alt.Scale(domain=[0, 1.01]), title='Catch share rate',
+                axis=alt.Axis(values=[0, 0.25, 0.50, 0.75, 1.00], labelFontSize=25, titleFontSize=30,
+                              format='.2f', grid=False))
+    ), 'catch_share_curve')
+    points = _series(alt.Chart().mark_point(shape='circle', clip=True, filled=True, fill='white', stroke='black',
+                                            fillOpacity=1, size=80).encode(
+        x='length:Q', y='value:Q'
+    ), 'catch_points')
+    test = _series(alt.Chart().mark_line(size=1, color='darkgrey', clip=True).encode(
+        x='length:Q',
+        y=alt.Y('value:Q', scale=alt.Scale(domain=[0, 2000]), title='Number captured',
+                axis=alt.Axis(orient='right', labelFontSize=25, titleFontSize=30, titlePadding=20, grid=False,
+                              format='d', values=[0, 500, 1000, 1500, 2000]))
+    ), 'test_population')
+    control = _series(alt.Chart().mark_line(size=1, color='black', clip=True).encode(
+        x='length:Q', y='value:Q'
+    ), 'control_population')
+    return alt.layer(test + control, curve + points).resolve_scale(y='independent')
+
+
+def sel_cur_facet_layers():
+    # the layers of build_chart2
+    main = _series(alt.Chart().mark_line(color='black', clip=True, size=5).encode(
+        x=_axis_x(),
+        y=alt.Y('value:Q', scale=alt.Scale(domain=[0, 1.01]), title='Retention probability',
+                axis=alt.Axis(values=[0, 0.25, 0.50, 0.75, 1.00], labelFontSize=25, titleFontSize=30,
+                              titlePadding=20, format='.2f', grid=False))
+    ), 'main_curve')
+    limits = [
+        _series(alt.Chart().mark_line(color='black', clip=True, strokeDash=[5, 5], size=2).encode(
+            x='length:Q', y='value:Q'
+        ), name)
+        for name in ('lower_limit', 'upper_limit')
+    ]
+    return alt.layer(main, *limits)
+
+
+def _mesh_rows(layers, meshes):
+    # one row per mesh, the mesh on the left of every row
+    # (flush bounds: rows are placed by the view size only, so both columns line up,
+    # the labels are then moved past the y axis with labelPadding)
+    return alt.FacetChart(
+        spec=layers.properties(width=400, height=250),
+        facet=alt.FacetMapping(row=alt.Facet('mesh:N', sort=meshes, title=None,
+                                             header=alt.Header(labelAngle=0, labelAlign='right', labelFontSize=30,
+                                                               labelPadding=110))),
+        spacing=80, bounds='flush'
+    ).resolve_scale(y='independent')  # own y axes in every row, as in generate_combined_chart
+
+
+def faceted_chart(tidy, title=None, title_font_size=30):
+    """
+    Figure with one row per mesh (catch share left, selection curve right), drawn from the
+    long format table of one species and year (filter the table first for more of them).
+    The data is given once at the top of the figure and shared by both facets.
+    """
+    if tidy['species'].nunique() > 1 or tidy['year'].nunique() > 1:
+        raise ValueError('faceted_chart draws one species and year, filter the table first')
+    meshes = [str(mesh) for mesh in tidy['mesh'].unique()]
+    figure = alt.hconcat(_mesh_rows(catch_share_facet_layers(), meshes), _mesh_rows(sel_cur_facet_layers(), meshes),
+                         data=alt.InlineData(values=chart_values(tidy)), spacing=90).configure_view(stroke=None)
+    if title is not None:
+        figure = figure.properties(title=title).configure_title(fontSize=title_font_size)
+    return figure
+
+
+# everything that changes the faceted figures, hashed for the incremental builds (build_manifest.py)
+FACET_MODULES = (sys.modules[__name__], data_cache, plot_files, curve_simplify, chart_templates, static_export)